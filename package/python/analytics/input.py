@@ -14,6 +14,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import atexit
 import os
 import sys
 
@@ -22,6 +23,7 @@ from datetime import datetime
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lib"))
 import splunklib.client as client
 import python.utils as utils
+from python.hec import HECClient
 
 __all__ = [
     "AnalyticsTracker",
@@ -37,7 +39,13 @@ PROPERTY_PREFIX = "analytics_prop__"
 
 
 class AnalyticsTracker:
-    def __init__(self, application_name, splunk_info, index=ANALYTICS_INDEX_NAME):
+    """Tracks events in the index. Given a HEC url and token, the events are
+       sent through the HTTP Event Collector in batches, which are flushed
+       by close(), at the end of a with block or at exit; otherwise every
+       event is submitted on its own."""
+
+    def __init__(self, application_name, splunk_info, index=ANALYTICS_INDEX_NAME,
+                 hec_url=None, hec_token=None):
         self.application_name = application_name
         self.splunk = client.connect(**splunk_info)
         self.index = index
@@ -56,6 +64,19 @@ class AnalyticsTracker:
             })
         assert (ANALYTICS_SOURCETYPE in self.splunk.confs['props'])
 
+        self.hec = None
+        if hec_url and hec_token:
+            self.hec = HECClient(hec_url, hec_token, index=self.index,
+                                 sourcetype=ANALYTICS_SOURCETYPE)
+            # the events still queued are sent on exit
+            atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     @staticmethod
     def encode(props):
         encoded = " "
@@ -92,7 +113,25 @@ class AnalyticsTracker:
 
         event += AnalyticsTracker.encode(props)
 
-        self.splunk.indexes[self.index].submit(event, sourcetype=ANALYTICS_SOURCETYPE)
+        if self.hec is None:
+            self.splunk.indexes[self.index].submit(event, sourcetype=ANALYTICS_SOURCETYPE)
+            return
+
+        try:
+            timestamp = datetime.fromisoformat(time).timestamp()
+        except (TypeError, ValueError):
+            timestamp = None
+        self.hec.send(event, time=timestamp)
+
+    def flush(self):
+        """Send the events tracked so far."""
+        if self.hec is not None:
+            self.hec.flush()
+
+    def close(self):
+        if self.hec is not None:
+            atexit.unregister(self.close)
+            self.hec.close()
 
 
 def main():
@@ -19,8 +19,8 @@ import sys
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lib"))
 import splunklib.client as client
-import splunklib.results as results
 import python.utils as utils
+from python.columns import read_columns
 
 
 __all__ = [
@@ -44,15 +44,12 @@ class TimeRange:
 
 
 def counts(job, result_key):
-    applications = []
-    reader = results.JSONResultsReader(job.results(output_mode='json'))
-    for result in reader:
-        if isinstance(result, dict):
-            applications.append({
-                "name": result[result_key],
-                "count": int(result["count"] or 0)
-            })
-    return applications
+    columns = read_columns(job.results(output_mode='json_cols'),
+                           {"count": "int"})
+    if len(columns) == 0:
+        return []
+    return [{"name": name, "count": int(count)}
+            for name, count in zip(columns[result_key], columns["count"])]
 
 
 class AnalyticsRetriever:
@@ -77,19 +74,15 @@ class AnalyticsRetriever:
         )
         job = self.splunk.jobs.create(query, exec_mode="blocking")
 
+        # a single result with the distinct count of every property
+        columns = read_columns(job.results(output_mode='json_cols'),
+                               default="int")
         properties = []
-        reader = results.JSONResultsReader(job.results(output_mode='json'))
-        for result in reader:
-            if not isinstance(result, dict):
-                continue
-            for field, count in list(result.items()):
-                # Ignore internal JSONResultsReader properties
-                if field.startswith("$"):
-                    continue
-
+        for field in columns.names:
+            for count in columns[field]:
                 properties.append({
                     "name": field,
-                    "count": int(count or 0)
+                    "count": int(count)
                 })
 
         return properties
@@ -102,15 +95,18 @@ class AnalyticsRetriever:
         )
         job = self.splunk.jobs.create(query, exec_mode="blocking")
 
+        columns = read_columns(job.results(output_mode='json_cols'),
+                               {"count": "int"})
+        if len(columns) == 0:
+            return []
+
         values = []
-        reader = results.JSONResultsReader(job.results(output_mode='json'))
-        for result in reader:
-            if isinstance(result, dict):
-                if result[property]:
-                    values.append({
-                        "name": result[property],
-                        "count": int(result["count"] or 0)
-                    })
+        for name, count in zip(columns[property], columns["count"]):
+            if name:
+                values.append({
+                    "name": name,
+                    "count": int(count)
+                })
 
         return values
 
@@ -122,27 +118,16 @@ class AnalyticsRetriever:
         )
         job = self.splunk.jobs.create(query, exec_mode="blocking")
 
+        # a _time column, then a column of counts per event/property
+        columns = read_columns(job.results(output_mode='json_cols'),
+                               {"_time": "str"}, default="int")
         over_time = {}
-        reader = results.JSONResultsReader(job.results(output_mode='json'))
-        for result in reader:
-            if isinstance(result, dict):
-                # Get the time for this entry
-                time = result["_time"]
-                del result["_time"]
-
-                # The rest is in the form of [event/property]:count
-                # pairs, so we decode those
-                for key, count in list(result.items()):
-                    # Ignore internal JSONResultsReader properties
-                    if key.startswith("$"):
-                        continue
-
-                    entry = over_time.get(key, [])
-                    entry.append({
-                        "count": int(count or 0),
-                        "time": time,
-                    })
-                    over_time[key] = entry
+        for key in columns.names:
+            if key == "_time":
+                continue
+            over_time[key] = [{"count": int(count), "time": time}
+                              for time, count in zip(columns["_time"],
+                                                     columns[key])]
 
         return over_time
 
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+#
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmarks the ingest examples against a local stand-in for splunkd.
+
+The stand-in answers just enough of the REST API for the examples to log in
+and look up their index, and counts the events it receives on
+receivers/stream, receivers/simple, data/inputs/oneshot, a raw tcp port and
+services/collector, without indexing them. Like splunkd, it serves https, with
+a throwaway certificate made by the openssl command. Every ingest path is run
+at each of the --loads, as a child process:
+
+    submit          submit.py, a file of events on stdin
+    upload          upload.py, the stand-in reads the file itself
+    stream          genevents.py --ingest=stream
+    simple          genevents.py --ingest=submit
+    tcp             genevents.py --ingest=tcp
+    hec             genevents.py --ingest=hec
+
+For every run, the events per second received, the CPU seconds spent by the
+child per million events and its peak memory are written to the --output
+json report. With --baseline, the runs are compared to those of an earlier
+report, and the script fails when one of them is --tolerance slower or
+costlier, so that it can be used in CI."""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import datetime
+import gzip
+import json
+import platform
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from utils import cmdline, error
+
+PATHS = ["submit", "upload", "stream", "simple", "tcp", "hec"]
+
+# Seconds the received event count must stay the same for a run to be over
+SETTLE_TIME = 0.2
+
+EVENT = "2024-01-01T00:00:00.000000 benchmark event number {} with some padding text\n"
+
+RULES = {
+    'paths': {
+        'flags': ["--paths"],
+        'default': ",".join(PATHS),
+        'help': f"Comma separated ingest paths to run (default is {','.join(PATHS)})"
+    },
+    'loads': {
+        'flags': ["--loads"],
+        'default': "10000,100000",
+        'help': "Comma separated numbers of events of the runs (default is 10000,100000)"
+    },
+    'workers': {
+        'flags': ["--workers"],
+        'default': 1,
+        'type': "int",
+        'help': "Number of senders of the genevents.py runs (default is 1)"
+    },
+    'output': {
+        'flags': ["--output"],
+        'default': "benchingest.json",
+        'help': "Write the report to this file (default is benchingest.json)"
+    },
+    'baseline': {
+        'flags': ["--baseline"],
+        'default': "",
+        'help': "Compare the runs to those of this earlier report"
+    },
+    'tolerance': {
+        'flags': ["--tolerance"],
+        'default': 0.2,
+        'type': "float",
+        'help': "Fraction by which a run may be worse than its baseline (default is 0.2)"
+    }
+}
+
+FEED = """<feed xmlns="http://www.w3.org/2005/Atom" xmlns:s="http://dev.splunk.com/ns/rest">
+<entry><title>{name}</title><id>/services/{path}</id>
+<link href="/services/{path}" rel="alternate"/>
+<content type="text/xml"><s:dict><s:key name="disabled">0</s:key></s:dict></content>
+</entry></feed>"""
+
+
+class Counter:
+    """The events and bytes received by the stand-in."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = 0
+        self.bytes = 0
+
+    def add(self, events, size):
+        with self.lock:
+            self.events += events
+            self.bytes += size
+
+    def reset(self):
+        with self.lock:
+            self.events = 0
+            self.bytes = 0
+
+
+class SplunkdHandler(BaseHTTPRequestHandler):
+    """The REST endpoints used by the ingest examples."""
+    protocol_version = "HTTP/1.1"
+    counter = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, content_type="text/xml"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            # the sdk's default handler reads the body after it closed the
+            # connection, which only works if the response says so
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def endpoint(self):
+        """The path of the request, without its namespace."""
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if parts[0] == "servicesNS":
+            parts = parts[3:]
+        elif parts[0] == "services":
+            parts = parts[1:]
+        return "/".join(parts)
+
+    def read_body(self):
+        length = self.headers.get("Content-Length")
+        if length is not None:
+            return self.rfile.read(int(length))
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return b""
+
+    def do_GET(self):
+        endpoint = self.endpoint()
+        name = endpoint.rsplit("/", 1)[-1]
+        self.reply(200, FEED.format(name=name, path=endpoint))
+
+    def do_POST(self):
+        endpoint = self.endpoint()
+        if endpoint == "receivers/stream":
+            # the body goes on until the client closes the connection
+            while True:
+                block = self.rfile.read1(1024 * 1024)
+                if not block:
+                    break
+                self.counter.add(block.count(b"\n"), len(block))
+            self.close_connection = True
+            return
+
+        body = self.read_body()
+        if endpoint == "auth/login":
+            self.reply(200, "<response><sessionKey>benchmark</sessionKey></response>")
+        elif endpoint == "receivers/simple":
+            self.counter.add(body.count(b"\n"), len(body))
+            self.reply(200, "<response><results/></response>")
+        elif endpoint == "data/inputs/oneshot":
+            name = parse_qs(body.decode()).get("name", [""])[0]
+            size = events = 0
+            with open(name, "rb") as fpd:
+                for block in iter(lambda: fpd.read(1024 * 1024), b""):
+                    events += block.count(b"\n")
+                    size += len(block)
+            self.counter.add(events, size)
+            self.reply(201, "<response/>")
+        elif endpoint.startswith("collector/ack"):
+            acks = json.loads(body)['acks']
+            self.reply(200, json.dumps({'acks': {str(ack): True for ack in acks}}),
+                       "application/json")
+        elif endpoint.startswith("collector"):
+            size = len(body)
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            self.counter.add(body.count(b"\n") + 1 if body.strip() else 0, size)
+            self.reply(200, json.dumps({'text': "Success", 'code': 0, 'ackId': 0}),
+                       "application/json")
+        else:
+            self.reply(200, FEED.format(name=endpoint.rsplit("/", 1)[-1],
+                                        path=endpoint))
+
+
+class RawHandler(socketserver.BaseRequestHandler):
+    """A raw tcp input."""
+    counter = None
+
+    def handle(self):
+        while True:
+            block = self.request.recv(1024 * 1024)
+            if not block:
+                break
+            self.counter.add(block.count(b"\n"), len(block))
+
+
+class StandIn:
+    """Serve the REST API and the raw tcp input on local ports from
+       threads."""
+
+    def __init__(self, tmpdir):
+        self.counter = Counter()
+        handler = type("Handler", (SplunkdHandler,), {'counter': self.counter})
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.http.socket = certificate(tmpdir).wrap_socket(
+            self.http.socket, server_side=True)
+        raw = type("Handler", (RawHandler,), {'counter': self.counter})
+        self.raw = socketserver.ThreadingTCPServer(("127.0.0.1", 0), raw)
+        self.raw.daemon_threads = True
+        self.http.daemon_threads = True
+        for server in [self.http, self.raw]:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.http.server_address[1]
+
+    @property
+    def raw_port(self):
+        return self.raw.server_address[1]
+
+    def settle(self, expected, timeout=10):
+        """Wait until the expected events or no more events arrive."""
+        deadline = time.monotonic() + timeout
+        last = -1
+        while time.monotonic() < deadline:
+            events = self.counter.events
+            if events >= expected or events == last:
+                return events
+            last = events
+            time.sleep(SETTLE_TIME)
+        return self.counter.events
+
+    def close(self):
+        self.http.shutdown()
+        self.raw.shutdown()
+
+
+def certificate(tmpdir):
+    """A server context with a self-signed certificate."""
+    cert = os.path.join(tmpdir, "standin.pem")
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048",
+                        "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                        "-keyout", cert, "-out", cert],
+                       check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        error(f"Cannot make a certificate with openssl: {e}", 2)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert)
+    # a client that never reads, as on receivers/stream, would leave the
+    # tls 1.3 session tickets unread, and closing the socket then resets the
+    # connection, dropping the end of the stream
+    context.num_tickets = 0
+    return context
+
+
+def write_events(path, count):
+    with open(path, "w") as fpd:
+        for number in range(count):
+            fpd.write(EVENT.format(number))
+
+
+def commands(standin, load, workers, events_file):
+    """The command line and stdin of every ingest path at the given load."""
+    splunk = ["--host=127.0.0.1", f"--port={standin.port}", "--scheme=https",
+              "--username=admin", "--password=benchmark"]
+    genevents = ["genevents.py", *splunk, f"--count={load}", "--rate=0",
+                 f"--workers={workers}", "--batch=1000"]
+    return {
+        'submit': (["submit.py", *splunk, "main"], events_file),
+        'upload': (["upload.py", *splunk, "--index=main", events_file], None),
+        'stream': (genevents + ["--ingest=stream", "main"], None),
+        'simple': (genevents + ["--ingest=submit", "main"], None),
+        'tcp': (genevents + ["--ingest=tcp", f"--inputport={standin.raw_port}",
+                             "main"], None),
+        'hec': (genevents + ["--ingest=hec", "--hec-token=benchmark",
+                             f"--hec-url=https://127.0.0.1:{standin.port}",
+                             "main"], None),
+    }
+
+
+def run(standin, path, argv, stdin, load):
+    """Run an ingest path in a child process, returns its measures."""
+    standin.counter.reset()
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.monotonic()
+    # stderr goes to a file, as a child that filled a pipe nobody reads
+    # until it exits would block forever
+    with open(stdin, "rb") if stdin else open(os.devnull, "rb") as fpd, \
+            tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen([sys.executable] + argv, cwd=here,
+                                   stdin=fpd, stdout=subprocess.DEVNULL,
+                                   stderr=errors)
+        # wait4, unlike wait, returns the resource usage of the child
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        errors.seek(0)
+        stderr = errors.read().decode(errors="replace")
+    events = standin.settle(load)
+    elapsed = time.monotonic() - start
+    if process.returncode != 0:
+        error(f"{path} exited with {process.returncode}: {stderr.strip()}")
+    cpu = usage.ru_utime + usage.ru_stime
+    return {
+        'path': path,
+        'load': load,
+        'events': events,
+        'bytes': standin.counter.bytes,
+        'seconds': round(elapsed, 3),
+        'events_per_sec': round(events / elapsed, 1) if elapsed else 0,
+        'cpu_sec_per_million': round(cpu / events * 1e6, 3) if events else None,
+        'maxrss_kb': usage.ru_maxrss,
+        'exit': process.returncode,
+    }
+
+
+def compare(runs, baseline, tolerance):
+    """Print the runs worse than their baseline, returns their number."""
+    previous = {(item['path'], item['load']): item for item in baseline['runs']}
+    regressions = 0
+    for item in runs:
+        base = previous.get((item['path'], item['load']))
+        if base is None:
+            continue
+        checks = [("events/s", base['events_per_sec'], item['events_per_sec'], -1),
+                  ("cpu s/M events", base['cpu_sec_per_million'],
+                   item['cpu_sec_per_million'], 1),
+                  ("maxrss kB", base['maxrss_kb'], item['maxrss_kb'], 1)]
+        for name, before, after, sign in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change * sign > tolerance:
+                regressions += 1
+                print(f"regression: {item['path']} at {item['load']}: "
+                      f"{name} {before} -> {after} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    usage = "usage: %prog [options]"
+    opts = cmdline(sys.argv[1:], RULES, usage=usage)
+    paths = opts.kwargs['paths'].split(",")
+    for path in paths:
+        if path not in PATHS:
+            error(f"Unknown ingest path: {path}", 2)
+    loads = [int(load) for load in opts.kwargs['loads'].split(",")]
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        standin = StandIn(tmpdir)
+        for load in loads:
+            events_file = os.path.join(tmpdir, f"events-{load}.log")
+            write_events(events_file, load)
+            argvs = commands(standin, load, opts.kwargs['workers'], events_file)
+            for path in paths:
+                argv, stdin = argvs[path]
+                result = run(standin, path, argv, stdin, load)
+                runs.append(result)
+                print(f"{path:8} {load:>10} events: "
+                      f"{result['events_per_sec']:>12.0f} events/s "
+                      f"{result['cpu_sec_per_million'] or 0:>8.2f} cpu s/M "
+                      f"{result['maxrss_kb'] / 1024:>8.1f} MB")
+        standin.close()
+
+    report = {
+        'time': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': runs,
+    }
+    with open(opts.kwargs['output'], "w") as fpd:
+        json.dump(report, fpd, indent=2)
+
+    failed = [item for item in runs if item['exit'] != 0]
+    if opts.kwargs['baseline']:
+        with open(opts.kwargs['baseline']) as fpd:
+            baseline = json.load(fpd)
+        if compare(runs, baseline, opts.kwargs['tolerance']):
+            sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
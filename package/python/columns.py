@@ -0,0 +1,197 @@
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Reads search results into typed columns.
+
+In the json_cols output mode splunkd returns the results column by column,
+so a result set is decoded with a single json.loads and cast one column at a
+time, instead of building a dict per result and casting its fields one by
+one.
+
+    stream = job.results(output_mode="json_cols", count=0)
+    columns = read_columns(stream, {'count': "int"}, dictionary=["host"])
+    columns['count'].sum()
+    frame = columns.to_pandas()
+
+The schema maps field names to "str", "int" or "float", fields left out are
+of the default type, strings unless given. A missing int is 0 and a missing
+float is NaN, a multivalue field is cast from its first value. Low
+cardinality fields can be dictionary encoded, as int32 codes into their
+sorted distinct values.
+
+Columns are NumPy arrays when NumPy is installed, lists otherwise.
+to_pandas() and to_arrow() need pandas and pyarrow.
+"""
+
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ["ColumnSet", "Dictionary", "TYPES", "read_columns"]
+
+TYPES = ["str", "int", "float"]
+
+# Values of the missing numbers
+MISSING = {'int': "0", 'float': "nan"}
+
+
+class Dictionary:
+    """A dictionary encoded column: codes into the distinct values."""
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return self.values[self.codes[index]]
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.codes)
+
+    def decode(self):
+        """The column of values."""
+        if numpy is not None:
+            return self.values[self.codes]
+        return list(self)
+
+
+def scalar(value):
+    """A multivalue field as a single string."""
+    if isinstance(value, list):
+        return "\n".join(value)
+    return "" if value is None else value
+
+
+def cast(values, kind):
+    """Cast a column of strings to the given type."""
+    if kind == "str":
+        return numpy.array(values, dtype=object) if numpy is not None \
+            else values
+    if kind not in MISSING:
+        raise ValueError(f"Unknown column type: {kind}")
+
+    default = MISSING[kind]
+    values = [(value[0] if isinstance(value, list) and value else value)
+              or default for value in values]
+    if numpy is None:
+        convert = int if kind == "int" else float
+        return [convert(value) for value in values]
+    strings = numpy.array(values, dtype=str)
+    if kind == "float":
+        return strings.astype(numpy.float64)
+    try:
+        return strings.astype(numpy.int64)
+    except ValueError:
+        # numbers written with a decimal point
+        return strings.astype(numpy.float64).astype(numpy.int64)
+
+
+def encode(values):
+    """Dictionary encode a column of strings."""
+    values = [scalar(value) for value in values]
+    if numpy is not None:
+        distinct, codes = numpy.unique(numpy.array(values, dtype=object),
+                                       return_inverse=True)
+        return Dictionary(codes.astype(numpy.int32), distinct)
+    distinct = sorted(set(values))
+    index = {value: code for code, value in enumerate(distinct)}
+    return Dictionary([index[value] for value in values], distinct)
+
+
+class ColumnSet:
+    """The typed columns of a result set, by field name."""
+
+    def __init__(self, names, columns):
+        self.names = list(names)
+        self.columns = dict(zip(self.names, columns))
+
+    def __len__(self):
+        return len(self.columns[self.names[0]]) if self.names else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def get(self, name, default=None):
+        return self.columns.get(name, default)
+
+    def rows(self):
+        """Yield the results as dicts, for the consumers that need them."""
+        columns = [self.columns[name] for name in self.names]
+        for row in zip(*columns):
+            yield dict(zip(self.names, row))
+
+    def to_pandas(self):
+        """The columns as a pandas DataFrame, dictionary encoded columns as
+           categoricals."""
+        import pandas
+        data = {}
+        for name in self.names:
+            column = self.columns[name]
+            if isinstance(column, Dictionary):
+                column = pandas.Categorical.from_codes(column.codes,
+                                                       column.values)
+            data[name] = column
+        return pandas.DataFrame(data, columns=self.names)
+
+    def to_arrow(self):
+        """The columns as a pyarrow Table, dictionary encoded columns as
+           dictionary arrays."""
+        import pyarrow
+        arrays = []
+        for name in self.names:
+            column = self.columns[name]
+            if isinstance(column, Dictionary):
+                arrays.append(pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.array(column.codes, pyarrow.int32()),
+                    pyarrow.array(column.values, pyarrow.string())))
+            else:
+                try:
+                    arrays.append(pyarrow.array(column))
+                except pyarrow.ArrowInvalid:
+                    # a string column mixing single and multivalue fields
+                    arrays.append(pyarrow.array(
+                        [value if value is None else scalar(value)
+                         for value in column], pyarrow.string()))
+        return pyarrow.Table.from_arrays(arrays, names=self.names)
+
+
+def read_columns(stream, schema=None, dictionary=(), default="str"):
+    """Read a json_cols result stream into a ColumnSet, casting the fields
+       to their type in the schema, or the default type, and dictionary
+       encoding the given fields."""
+    schema = schema or {}
+    data = stream.read()
+    document = json.loads(data) if data.strip() else {}
+    if "results" in document:
+        raise ValueError("Results must be read with output_mode=json_cols")
+
+    names = [field['name'] if isinstance(field, dict) else field
+             for field in document.get('fields', [])]
+    columns = []
+    for name, values in zip(names, document.get('columns', [])):
+        if name in dictionary:
+            columns.append(encode(values))
+        else:
+            columns.append(cast(values, schema.get(name, default)))
+    return ColumnSet(names, columns)
@@ -17,35 +17,25 @@
 import os
 import sys
 from getpass import getpass
-import pandas as pd
 import matplotlib.pyplot as plt
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lib"))
 from splunklib import client
-from splunklib import results
 from python.utils import parse
+from python.columns import read_columns
+from python.jobrunner import run_job
 
 
 def plot_top_hash_tags(service):
-    job = service.jobs.create('search index=twitter | tophashtags top=10', **{"exec_mode": "normal"})
+    job = run_job(service, 'search index=twitter | tophashtags top=10', exec_mode="normal")
 
-    while True:
-        while not job.is_done():
-            pass
-        break
-
-    events = []
-    for result in results.JSONResultsReader(job.results(output_mode='json')):
-        events.append(result)
-
-    if len(events) <= 0:
+    columns = read_columns(job.results(output_mode='json_cols'),
+                           {"count": "float", "percent": "float"})
+    if len(columns) <= 0:
         print("No events found to plot")
         return
 
-    df = pd.DataFrame(events)
-    df["hashtag"] = df["hashtag"].astype(str)
-    df["count"] = df["count"].astype(float)
-    df["percent"] = df["percent"].astype(float)
+    df = columns.to_pandas()
 
     plt.bar(df["hashtag"], df["count"])
     plt.xlabel("Hashtags")
@@ -55,25 +45,15 @@ def plot_top_hash_tags(service):
 
 def plot_top_sources(service):
     query = 'search index=twitter | spath | rename data.source as source | stats count(source) as count by source | sort -count | head 10'
-    job = service.jobs.create(query, **{"exec_mode": "normal"})
-
-    while True:
-        while not job.is_done():
-            pass
-        break
+    job = run_job(service, query, exec_mode="normal")
 
-    events = []
-
-    for result in results.JSONResultsReader(job.results(output_mode='json')):
-        events.append(result)
-
-    if len(events) <= 0:
+    columns = read_columns(job.results(output_mode='json_cols'),
+                           {"count": "float"})
+    if len(columns) <= 0:
         print("No events found to plot")
         return
 
-    df = pd.DataFrame(events)
-    df["source"] = df["source"].astype(str)
-    df["count"] = df["count"].astype(float)
+    df = columns.to_pandas()
 
     plt.bar(df["source"], df["count"])
     plt.xlabel("Source")
@@ -83,25 +63,15 @@ def plot_top_sources(service):
 
 def plot_lang(service):
     query = 'search index=twitter | rename data.lang as language | stats count(language) as count by language'
-    job = service.jobs.create(query, **{"exec_mode": "normal"})
-
-    while True:
-        while not job.is_done():
-            pass
-        break
+    job = run_job(service, query, exec_mode="normal")
 
-    events = []
-
-    for result in results.JSONResultsReader(job.results(output_mode='json')):
-        events.append(result)
-
-    if len(events) <= 0:
+    columns = read_columns(job.results(output_mode='json_cols'),
+                           {"count": "float"})
+    if len(columns) <= 0:
         print("No events found to plot")
         return
 
-    df = pd.DataFrame(events)
-    df["language"] = df["language"].astype(str)
-    df["count"] = df["count"].astype(float)
+    df = columns.to_pandas()
 
     plt.bar(df["language"], df["count"])
     plt.xlabel("Language")
@@ -111,25 +81,15 @@ def plot_lang(service):
 
 def plot_annotations(service):
     query = 'search index=twitter | rename includes.tweets{}.entities.annotations{}.type as type | stats count(type) as count by type'
-    job = service.jobs.create(query, **{"exec_mode": "normal"})
-
-    while True:
-        while not job.is_done():
-            pass
-        break
-
-    events = []
-
-    for result in results.JSONResultsReader(job.results(output_mode='json')):
-        events.append(result)
+    job = run_job(service, query, exec_mode="normal")
 
-    if len(events) <= 0:
+    columns = read_columns(job.results(output_mode='json_cols'),
+                           {"count": "float"})
+    if len(columns) <= 0:
         print("No events found to plot")
         return
 
-    df = pd.DataFrame(events)
-    df["type"] = df["type"].astype(str)
-    df["count"] = df["count"].astype(float)
+    df = columns.to_pandas()
 
     plt.bar(df["type"], df["count"])
     plt.xlabel("Type")
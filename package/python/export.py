@@ -26,7 +26,12 @@ The CLI arguments for the export are as follows (all arguments are of the form
 `arg=value`):
 
     --index 	specifies the index to export. Default is all indexes.
+    --fanout	exports every index matching the --index glob on its own, see
+                "Fan-out export" below.
     --progress 	prints progress to stdout. Default is no progress shown.
+    --metrics	appends progress metrics as json lines to this file. Default
+                is no metrics.
+    --interval	seconds between two progress reports. Default is 5.
     --starttime	starttime in SECONDS from 1970. Default is start at beginning of
                 index.
     --endtime	endtime in SECONDS from 1970. Default is end at the end of the
@@ -34,16 +39,102 @@ The CLI arguments for the export are as follows (all arguments are of the form
     --output	output file name. Default is the current working directory,
                 export.out.
     --limit		limits the number of events per chunk. The number actually used
-                may be smaller than this limit. Deafult is 100,000.
+                may be smaller than this limit. Default is no limit.
+    --slices	splits the start/end range into this many time slices that are
+                exported in parallel. Default is 1.
+    --concurrency	number of slices exported at the same time. Default is 4.
+    --attempts	number of times a failed slice is tried before giving up.
+                Default is 5.
     --restart	restarts the export if terminated prematurely.
+    --recover	resumes an existing export, see "Checkpoints" below.
     --omode		specifies the output format of the resulting export, the
-                allowable formats are xml, json, csv.
+                allowable formats are xml, json, csv and parquet.
+    --compress	compresses the export file with gzip or zstd. Default is none.
 
 ### Friendly start/end times
 
 Currently, the start/end times are given as seconds from 1970, which is not
 the most friendly/intuitive format.
 
+### Parallel export
+
+When `--slices` is given, the start/end range is cut into that many equal time
+slices. If either end of the range is missing, it is looked up with a
+`| tstats` pass over the index. When `--limit` is given, the slices are sized
+by event density instead: a `| tstats count ... by _time` pass counts the
+events of the index in `HISTOGRAM_BUCKETS` time buckets, and the range is cut
+at bucket edges so that each slice holds at most `--limit` events, or at most
+its share of the events over `--slices` slices if that is smaller. A bucket
+holding more than that is split evenly. The counts cover the index, not the
+`--search` filter, so with a filter the slices hold fewer events. Each slice
+is exported to its own `<output>.NNNN.part` file by a pool of `--concurrency`
+workers and retried on its own when it fails. Once all slices are done, the
+part files are stitched into `--output` newest first, matching the order of a
+single export stream, and removed.
+
+### Fan-out export
+
+With `--fanout`, `--index` is a glob matched against the names of the
+indexes of the server (internal indexes only match a glob that starts with
+`_`), and `--output` is a directory. Every matching index is exported on its
+own, cut into slices as above, and every slice is written to a shard of its
+own, `<output>/<index>/NNNN.<omode>`, with `.gz` or `.zst` appended when
+compressed. The slices of all the indexes share a single pool of
+`--concurrency` workers. Every index keeps its own `<output>/<index>.manifest`
+with a checkpoint per shard, so that `--recover` resumes each index where it
+stopped; an index whose directory exists without a manifest is complete and
+is skipped, remove its directory to export it again.
+
+### Progress
+
+`--progress` keeps a status line on stdout with the export throughput over
+the last interval in bytes and events per second, the `_time` watermark (all
+events newer than it are exported), the number of finished slices and, when
+the start/end range is known, an estimate of the remaining time. `--metrics`
+appends the same numbers, along with the state, bytes, events and watermark
+of every slice, to a file as one json object per line.
+
+### Checkpoints
+
+While it runs, export keeps a small `<output>.manifest` JSON file next to the
+output. For every slice it holds the byte offset up to which the slice is
+durably written, the `_time` of the last committed event and the number of
+committed events. An offset is only committed at the end of an event whose
+successor has a different `_time`. With `--recover`, export reads the
+manifest, truncates each unfinished slice at its committed offset and resumes
+it from there; finished slices are not exported again. The manifest is
+removed once the export completes. Exports without a manifest fall back to
+scanning the tail of the output file.
+
+### Duplicate events
+
+Events are identified by their `(_cd, _time, _bkt)` key. A resumed slice is
+exported again from the millisecond of its last committed `_time`, so that
+events sharing that `_time` are not lost, and the events already written are
+dropped: the keys of the events in the last `DEDUP_TAIL` bytes before the
+checkpoint are kept in a window of at most `DEDUP_WINDOW` keys, and the head
+of the resumed stream is looked up in it until an event older than the window
+shows up. The head of every part file is checked the same way against the
+tail of the previous part when the parts are stitched. Events without a
+`_cd` or `_bkt` field, such as the results of a transforming search, cannot
+be told apart; a slice made of them is resumed below its last `_time`.
+
+### Compressed and columnar output
+
+`--compress gzip` (or `zstd`, when the `zstandard` package is installed)
+compresses the export file. `--omode parquet` (requires `pyarrow`) exports the
+events as json and writes them to a Parquet file in row groups of
+`ROW_GROUP_SIZE` events, using `--compress` as the Parquet column codec. The
+columns are the fields of the first row group, all as strings, plus an
+`_extra` column holding any other field of an event as a json object.
+
+Compressed and Parquet exports always go through part files. The output is
+encoded on a thread of its own while the slices are still being exported, so
+compressing does not slow down the network reads. Every stitched part ends a
+gzip member or zstd frame, which concatenate into a valid file, so that a
+compressed export can be resumed at the last stitched part. A Parquet file
+cannot be appended to, it is written again from the part files on resume.
+
 ## Notes
 
 * 	When using csv or json output formats, sideband messages are not included. If
@@ -52,29 +143,109 @@ the most friendly/intuitive format.
 import os
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+import gzip
+import json
+import math
+import queue
+import threading
 import time
-from os import path
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
 
 # splunk support files
-from splunklib.binding import connect
-from utils import parse
+from splunklib.binding import HTTPError
+from splunklib.client import connect
+from splunklib.results import JSONResultsReader
+from records import RecordSplitter
+from utils import parse, iter_blocks, Record
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 # hidden file
 OUTPUT_FILE = "./export.out"
 OUTPUT_MODE = "xml"
-OUTPUT_MODES = ["csv", "xml", "json"]
+OUTPUT_MODES = ["csv", "xml", "json", "parquet"]
+COMPRESSION = "none"
+COMPRESSIONS = ["none", "gzip", "zstd"]
+SHARD_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+MANIFEST_SUFFIX = ".manifest"
+# size of the reads from the export stream
+CHUNK_SIZE = 1024 * 1024
+# number of bytes written to a slice between two checkpoints
+CHECKPOINT_SIZE = 16 * 1024 * 1024
+# number of events per parquet row group
+ROW_GROUP_SIZE = 64 * 1024
+# number of time buckets of the event histogram that adaptive slices are
+# cut from
+HISTOGRAM_BUCKETS = 1000
+# number of event keys looked up to drop the events exported twice, and the
+# number of bytes before a resume point they are read from
+DEDUP_WINDOW = 64 * 1024
+DEDUP_TAIL = 4 * 1024 * 1024
 
 CLIRULES = {
+    'attempts': {
+        'flags': ["--attempts"],
+        'default': 5,
+        'type': "int",
+        'help': "Number of times a failed slice is tried (default is 5)"
+    },
+    'compress': {
+        'flags': ["--compress"],
+        'default': COMPRESSION,
+        'help': f"output compression {COMPRESSIONS} default is {COMPRESSION}"
+    },
+    'concurrency': {
+        'flags': ["--concurrency"],
+        'default': 4,
+        'type': "int",
+        'help': "Number of slices exported at the same time (default is 4)"
+    },
     'end': {
         'flags': ["--endtime"],
         'default': "",
         'help': "Start time of export (default is start of index)"
     },
+    'fanout': {
+        'flags': ["--fanout"],
+        'default': False,
+        'action': "store_true",
+        'help': "Export every index matching --index to its own shards"
+    },
     'index': {
         'flags': ["--index"],
         'default': "*",
         'help': "Index to export (default is all user defined indices)"
     },
+    'interval': {
+        'flags': ["--interval"],
+        'default': 5,
+        'type': "float",
+        'help': "Seconds between progress reports (default is 5)"
+    },
+    'limit': {
+        'flags': ["--limit"],
+        'default': 0,
+        'type': "int",
+        'help': "Maximum number of events per slice (default is no limit)"
+    },
+    'metrics': {
+        'flags': ["--metrics"],
+        'default': "",
+        'help': "Append progress metrics as json lines to this file"
+    },
     'omode': {
         'flags': ["--omode"],
         'default': OUTPUT_MODE,
@@ -85,6 +256,12 @@ CLIRULES = {
         'default': OUTPUT_FILE,
         'help': f"Output file name (default is {OUTPUT_FILE})"
     },
+    'progress': {
+        'flags': ["--progress"],
+        'default': False,
+        'action': "store_true",
+        'help': "Print export progress to stdout"
+    },
     'recover': {
         'flags': ["--recover"],
         'default': False,
@@ -95,6 +272,12 @@ CLIRULES = {
         'default': "search *",
         'help': "search string (default 'search *')"
     },
+    'slices': {
+        'flags': ["--slices"],
+        'default': 1,
+        'type': "int",
+        'help': "Number of time slices exported in parallel (default is 1)"
+    },
     'start': {
         'flags': ["--starttime"],
         'default': "",
@@ -103,188 +286,436 @@ CLIRULES = {
 }
 
 
-def get_csv_next_event_start(location, event_buffer):
-    """ determin the event start and end of *any* valid event """
-
-    start = -1
-    end = -1
-
-    event_start = event_buffer.find("\n", location + 1)
-    event_end = event_buffer.find('"\n', event_start + 1)
+class OutputWriter(threading.Thread):
+    """ write the export file on a thread of its own, so that compressing
+        the output does not hold up the network reads. Every commit ends the
+        current gzip member or zstd frame """
+
+    COMMIT = object()
+    resumable = True
+
+    def __init__(self, fd, compress):
+        threading.Thread.__init__(self, daemon=True)
+        self.fd = fd
+        self.compress = compress
+        self.stream = None
+        self.error = None
+        self.offset = fd.tell()
+        self.queue = queue.Queue(maxsize=16)
+        self.start()
+
+    def write(self, data):
+        """ queue a block of the export for writing """
+
+        self.check()
+        self.queue.put(data)
+
+    def commit(self):
+        """ write out everything queued so far, and return the durable size
+            of the export file """
+
+        self.queue.put(self.COMMIT)
+        self.queue.join()
+        self.check()
+        return self.offset
+
+    def close(self):
+        """ commit and stop the writer thread """
+
+        offset = self.commit()
+        self.queue.put(None)
+        self.join()
+        self.check()
+        return offset
+
+    def check(self):
+        """ raise the error the writer thread failed with, if any """
+
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    if self.error is None:
+                        self.finish()
+                    return
+                if self.error is None:
+                    if item is self.COMMIT:
+                        self.end()
+                    else:
+                        self.encode(item)
+            except Exception as e:  # handed over to the exporting thread
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def encode(self, data):
+        if self.stream is None:
+            if self.compress == "gzip":
+                self.stream = gzip.GzipFile(fileobj=self.fd, mode="wb")
+            elif self.compress == "zstd":
+                self.stream = zstandard.ZstdCompressor().stream_writer(
+                    self.fd, closefd=False)
+            else:
+                self.stream = self.fd
+        self.stream.write(data)
+
+    def end(self):
+        if self.stream is not None and self.stream is not self.fd:
+            self.stream.close()
+        self.stream = None
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.offset = self.fd.tell()
+
+    def finish(self):
+        pass
+
+
+class ParquetWriter(OutputWriter):
+    """ decode the json export and write it to a Parquet file, in row groups
+        of ROW_GROUP_SIZE events """
+
+    resumable = False
+
+    def __init__(self, fd, compress):
+        self.pending = b""
+        self.rows = []
+        self.writer = None
+        OutputWriter.__init__(self, fd, compress)
+
+    def encode(self, data):
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        for line in lines:
+            if b'"result"' in line:
+                self.rows.append(json.loads(line)['result'])
+        if len(self.rows) >= ROW_GROUP_SIZE:
+            self.write_rows()
+
+    def write_rows(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            # the columns are the fields of the first row group
+            names = list(dict.fromkeys(key for row in self.rows for key in row))
+            names.append("_extra")
+            self.schema = pyarrow.schema([(name, pyarrow.string())
+                                          for name in names])
+            self.writer = pyarrow.parquet.ParquetWriter(
+                self.fd, self.schema, compression=self.compress)
+        columns = {name: [] for name in self.schema.names}
+        for row in self.rows:
+            extra = {key: value for key, value in row.items()
+                     if key not in columns}
+            row["_extra"] = json.dumps(extra) if extra else None
+            for name, column in columns.items():
+                value = row.get(name)
+                column.append(value if value is None or isinstance(value, str)
+                              else json.dumps(value))
+        self.writer.write_table(
+            pyarrow.Table.from_pydict(columns, schema=self.schema))
+        self.rows = []
+
+    def end(self):
+        self.write_rows()
+        self.fd.flush()
+        self.offset = self.fd.tell()
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        self.offset = self.fd.tell()
+
+
+def open_writer(options, fd):
+    """ the writer for the compression and format of the export """
+
+    if options.kwargs['omode'] == "parquet":
+        return ParquetWriter(fd, options.kwargs['compress'])
+    return OutputWriter(fd, options.kwargs['compress'])
+
+
+def stream_format(options):
+    """ the format requested from the export endpoint """
+
+    if options.kwargs['omode'] == "parquet":
+        return "json"
+    return options.kwargs['omode']
+
+
+class Progress(threading.Thread):
+    """ report the throughput, the _time watermark, the state of each slice
+        and the remaining time of the export, to stdout and/or as json lines
+        to a metrics file """
+
+    def __init__(self, options, slices):
+        threading.Thread.__init__(self, daemon=True)
+        self.slices = slices
+        self.show = options.kwargs['progress']
+        self.metrics = options.kwargs['metrics']
+        self.interval = options.kwargs['interval']
+        # keyed by slice, as fan-out slices of different indexes share
+        # their numbers
+        self.stats = {id(piece): Record(state=piece.state, bytes=0,
+                                        events=0, watermark=None)
+                      for piece in slices}
+        self.started = time.time()
+        self.last = (self.started, 0, 0)
+        self.width = 0
+        self.stopped = threading.Event()
+        if self.show or self.metrics:
+            self.start()
+
+    def update(self, piece, nbytes, nevents, watermark):
+        """ account for a block of a slice written to disk """
+
+        stats = self.stats[id(piece)]
+        stats.state = "running"
+        stats.bytes += nbytes
+        stats.events += nevents
+        if watermark is not None:
+            stats.watermark = watermark
+
+    def finish(self, piece, state):
+        self.stats[id(piece)].state = state
+
+    def stop(self):
+        if self.is_alive():
+            self.stopped.set()
+            self.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+        self.report()
+        if self.show:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+    def watermark(self):
+        """ the _time above which every slice is exported """
+
+        for piece in self.slices:
+            stats = self.stats[id(piece)]
+            if stats.state not in ["done", "stitched"]:
+                return stats.watermark or piece.last_time or piece.latest
+        return self.slices[-1].earliest
+
+    def covered(self):
+        """ the part of the start/end range that is exported, if known """
+
+        total = 0.0
+        covered = 0.0
+        try:
+            for piece in self.slices:
+                stats = self.stats[id(piece)]
+                width = float(piece.latest) - float(piece.earliest)
+                total += width
+                if stats.state in ["done", "stitched"]:
+                    covered += width
+                elif stats.watermark or piece.last_time:
+                    mark = float(stats.watermark or piece.last_time)
+                    covered += float(piece.latest) - mark
+        except ValueError:
+            return None
+        return covered / total if total > 0 else None
+
+    def describe(self, piece):
+        """ the metrics of a slice """
+
+        stats = dict(self.stats[id(piece)], number=piece.number)
+        if 'index' in piece:
+            stats['index'] = piece.index
+        return stats
+
+    def report(self):
+        now = time.time()
+        nbytes = sum(stats.bytes for stats in self.stats.values())
+        nevents = sum(stats.events for stats in self.stats.values())
+        elapsed = max(now - self.last[0], 1e-6)
+        bytes_rate = (nbytes - self.last[1]) / elapsed
+        events_rate = (nevents - self.last[2]) / elapsed
+        self.last = (now, nbytes, nevents)
+
+        done = sum(1 for stats in self.stats.values()
+                   if stats.state in ["done", "stitched"])
+        covered = self.covered()
+        eta = None
+        if covered:
+            eta = (now - self.started) * (1 - covered) / covered
+        watermark = self.watermark()
+
+        if self.show:
+            status = f"\r{nbytes / 2**20:.1f} MB | {bytes_rate / 2**20:.2f} MB/s" \
+                     f" | {nevents} events | {events_rate:.0f} events/s"
+            if watermark:
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S",
+                                      time.localtime(float(watermark)))
+                status += f" | _time {stamp}"
+            status += f" | {done}/{len(self.slices)} slices"
+            if eta is not None:
+                status += f" | ETA {eta:.0f}s"
+            # pad to blank out the rest of a longer previous line
+            sys.stdout.write(status.ljust(self.width))
+            self.width = len(status)
+            sys.stdout.flush()
+
+        if self.metrics:
+            line = {'time': now, 'elapsed': now - self.started,
+                    'bytes': nbytes, 'bytes_per_sec': bytes_rate,
+                    'events': nevents, 'events_per_sec': events_rate,
+                    'watermark': watermark, 'covered': covered, 'eta': eta,
+                    'slices': [self.describe(piece) for piece in self.slices]}
+            with open(self.metrics, "a") as fpd:
+                fpd.write(json.dumps(line) + "\n")
+
+
+def recent_events(fd, end, event_format):
+    """ the (key, _time) tuples of the events in the last DEDUP_TAIL bytes
+        before the given offset of an export file """
+
+    start = max(end - DEDUP_TAIL, 0)
+    header = None
+    if event_format == "csv" and start > 0:
+        fd.seek(0)
+        header = fd.readline()
+    fd.seek(start)
+    data = fd.read(end - start)
+    splitter = RecordSplitter(event_format, header=header, aligned=start == 0)
+    return [(splitter.key(data[offset:offset + length]), event_time)
+            for offset, length, event_time in splitter.feed(data)]
+
+
+class Deduplicator:
+    """ drop the events at the head of an export stream that are already
+        written. The keys of the written events are kept in a window of
+        DEDUP_WINDOW keys, and the stream is only looked up until an event
+        older than the oldest of them """
+
+    def __init__(self, splitter, events):
+        self.splitter = splitter
+        self.window = OrderedDict()
+        self.oldest = None
+        for key, event_time in events:
+            if key is None:
+                continue
+            self.window[hash(key)] = None
+            self.window.move_to_end(hash(key))
+            if len(self.window) > DEDUP_WINDOW:
+                self.window.popitem(last=False)
+            try:
+                self.oldest = min(float(event_time), self.oldest or math.inf)
+            except ValueError:
+                pass
+        self.active = bool(self.window) and self.oldest is not None
+        self.held = bytearray()  # bytes not written yet
+        self.start = None  # stream offset of the held bytes
+        self.skipped = 0  # number of bytes dropped so far
+
+    def seen(self, record, event_time):
+        """ whether the event is already written, stops the lookups at the
+            first event older than the window """
 
-    while event_end > 0:
-        parts = event_buffer[event_start:event_end].split(",")
-        # test parts 0 and 1 of CSV. Format should be time.qqq, anything
-        # else is not time stamp to keep moving.
         try:
-            int(parts[0].replace('\n', ""))
-            timestamp = parts[1].replace('"', "")
-            timeparts = timestamp.split('.')
-            int(timeparts[0])
-            int(timeparts[1])
-            return event_start, event_end
-        except:
-            event_start = event_buffer.find("\n", event_end + 2)
-            event_end = event_buffer.find('"\n', event_start + 1)
-
-    return (start, end)
-
-
-def get_csv_event_start(event_buffer):
-    """ get the event start of an event that is different (in time)from the
-        adjoining event, in CSV format """
-
-    (start, end) = get_csv_next_event_start(0, event_buffer)
-    if start < 0:
-        return -1, -1, ""
-
-    print(event_buffer[start:end])
-
-    tstart = event_buffer.find(",", start)
-    tend = event_buffer.find(",", tstart + 1)
-    print(event_buffer[tstart:tend])
-    last_time = event_buffer[tstart + 1:tend].replace('"', "")
-
-    while end > 0:
-        (start, end) = get_csv_next_event_start(start, event_buffer)
-        if end < 0:
-            return -1, -1, ""
-        tstart = event_buffer.find(",", start)
-        tend = event_buffer.find(",", tstart + 1)
-        this_time = event_buffer[tstart + 1:tend].replace('"', "")
-        if this_time != last_time:
-            return start, end + 1, last_time
-
-    return -1, -1, ""
-
-
-def get_xml_event_start(event_buffer):
-    """ get the event start of an event that is different (in time)from the
-        adjoining event, in XML format """
-
-    result_pattern = "<result offset='"
-    time_key_pattern = "<field k='_time'>"
-    time_start_pattern = "<value><text>"
-    time_end_pattern = "<"
-    event_end_pattern = "</result>"
-
-    event_start = event_buffer.find(result_pattern)
-    event_end = event_buffer.find(event_end_pattern, event_start) + \
-                len(event_end_pattern)
-    if event_end < 0:
-        return -1, -1, ""
-    time_key_start = event_buffer.find(time_key_pattern, event_start)
-    time_start = event_buffer.find(time_start_pattern, time_key_start) + \
-                 len(time_start_pattern)
-    time_end = event_buffer.find(time_end_pattern, time_start + 1)
-    last_time = event_buffer[time_start:time_end]
-
-    # wallk through events until time changes
-    event_start = event_end
-    while event_end > 0:
-        event_start = event_buffer.find(result_pattern, event_start + 1)
-        event_end = event_buffer.find(event_end_pattern, event_start) + \
-                    len(event_end_pattern)
-        if event_end < 0:
-            return -1, -1, ""
-        time_key_start = event_buffer.find(time_key_pattern, event_start)
-        time_start = event_buffer.find(time_start_pattern, time_key_start)
-        time_end = event_buffer.find(time_end_pattern, time_start)
-        this_time = event_buffer[time_start:time_end]
-        if this_time != last_time:
-            return event_start, event_end, last_time
-        event_start = event_end
-
-    return -1, -1, ""
-
-
-def get_json_event_start(event_buffer):
-    """ get the event start of an event that is different (in time)from the
-        adjoining event, in XML format """
-
-    event_start_pattern = '{"_cd":"'
-    time_key_pattern = '"_time":"'
-    time_end_pattern = '"'
-    event_end_pattern = '"},\n'
-    event_end_pattern2 = '"}[]'  # old json output format bug
-
-    event_start = event_buffer.find(event_start_pattern)
-    event_end = event_buffer.find(event_end_pattern, event_start) + \
-                len(event_end_pattern)
-    if event_end < 0:
-        event_end = event_buffer.find(event_end_pattern2, event_start) + \
-                    len(event_end_pattern2)
-    if event_end < 0:
-        return -1, -1, ""
-
-    time_start = event_buffer.find(time_key_pattern, event_start) + \
-                 len(time_key_pattern)
-    time_end = event_buffer.find(time_end_pattern, time_start + 1)
-    last_time = event_buffer[time_start:time_end]
-
-    event_start = event_end
-    while event_end > 0:
-        event_start = event_buffer.find(event_start_pattern, event_start + 1)
-        event_end = event_buffer.find(event_end_pattern, event_start) + \
-                    len(event_end_pattern)
-        if event_end < 0:
-            event_end = event_buffer.find(event_end_pattern2, event_start) + \
-                        len(event_end_pattern2)
-        if event_end < 0:
-            return -1, -1, ""
-        time_start = event_buffer.find(time_key_pattern, event_start) + \
-                     len(time_key_pattern)
-        time_end = event_buffer.find(time_end_pattern, time_start + 1)
-        this_time = event_buffer[time_start:time_end]
-        if this_time != last_time:
-            return event_start - 2, event_end, last_time
-        event_start = event_end
-
-    return -1, -1, ""
-
-
-def get_event_start(event_buffer, event_format):
-    """ dispatch event start method based on event format type """
-
-    if event_format == "csv":
-        return get_csv_event_start(event_buffer)
-    if event_format == "xml":
-        return get_xml_event_start(event_buffer)
-    return get_json_event_start(event_buffer)
+            if float(event_time) < self.oldest:
+                self.active = False
+                return False
+        except ValueError:
+            self.active = False
+            return False
+        key = self.splitter.key(record)
+        return key is not None and hash(key) in self.window
+
+    def feed(self, content, position, records):
+        """ filter the next block of the stream, at the given stream offset,
+            and its events. Returns the bytes to write and the events kept,
+            their offsets moved back by the bytes dropped before them """
+
+        if not self.active and not self.held:
+            if self.skipped == 0:
+                return content, records
+            return content, [(offset - self.skipped, length, event_time)
+                             for offset, length, event_time in records]
+
+        if self.start is None:
+            self.start = position
+        self.held += content
+        data = bytearray()
+        kept = []
+        cursor = self.start
+        for offset, length, event_time in records:
+            begin = offset - self.start
+            if self.active and \
+                    self.seen(self.held[begin:begin + length], event_time):
+                data += self.held[cursor - self.start:begin]
+                cursor = offset + length
+                self.skipped += length
+                continue
+            kept.append((offset - self.skipped, length, event_time))
+
+        # hold back the event the block ends in while it may be dropped
+        end = self.start + len(self.held)
+        if self.active:
+            end = max(cursor, records[-1][0] + records[-1][1]) if records \
+                else cursor
+        data += self.held[cursor - self.start:end - self.start]
+        del self.held[:end - self.start]
+        self.start = end
+        return bytes(data), kept
+
+    def flush(self):
+        """ the bytes held back at the end of the stream """
+
+        data = bytes(self.held)
+        self.held.clear()
+        return data
 
 
 def recover(options):
-    """ recover from an existing export run. We do this by
-        finding the last time change between events, truncate the file
-        and restart from there """
+    """ recover from an existing export run without a manifest. We do this
+        by splitting the tail of the file into events, finding the last
+        time change between events, truncate the file there and restart
+        from there """
 
     event_format = options.kwargs['omode']
 
     buffer_size = 64 * 1024
-    with open(options.kwargs['output'], "r+") as fpd:
+    with open(options.kwargs['output'], "r+b") as fpd:
+        header = fpd.readline() if event_format == "csv" else None
         fpd.seek(0, 2)  # seek to end
-        fptr = max(fpd.tell() - buffer_size, 0)
-        fptr_eof = 0
+        size = fpd.tell()
+        fptr = size
 
-        while fptr > 0:
+        while True:
+            # widen the tail until it holds a time change
+            fptr = max(fptr - buffer_size, 0)
+            buffer_size *= 2
             fpd.seek(fptr)
-            event_buffer = fpd.read(buffer_size)
-            (event_start, next_event_start, last_time) = \
-                get_event_start(event_buffer, event_format)
-            if event_start != -1:
-                fptr_eof = event_start + fptr
+            splitter = RecordSplitter(event_format, aligned=fptr == 0,
+                                      header=header if fptr > 0 else None)
+            records = splitter.feed(fpd.read(size - fptr))
+            changes = [record for record, successor in zip(records, records[1:])
+                       if record[2] != successor[2]]
+            if changes:
+                offset, length, last_time = changes[-1]
+                fptr_eof = offset + length + fptr
+                break
+            if fptr == 0:
+                # didn't find a valid event, so start over
+                fptr_eof = 0
+                last_time = 0
                 break
-            fptr = fptr - buffer_size
-
-        if fptr < 0:
-            # didn't find a valid event, so start over
-            fptr_eof = 0
-            last_time = 0
 
         # truncate file here
         fpd.truncate(fptr_eof)
         fpd.seek(fptr_eof)
-        fpd.write("\n")
+        fpd.write(b"\n")
 
     return last_time
 
@@ -293,61 +724,523 @@ def cleanup_tail(options):
     """ cleanup the tail of a recovery """
 
     if options.kwargs['omode'] == "csv":
-        options.kwargs['fd'].write("\n")
+        options.kwargs['fd'].write(b"\n")
     elif options.kwargs['omode'] == "xml":
-        options.kwargs['fd'].write("\n</results>\n")
+        options.kwargs['fd'].write(b"\n</results>\n")
     else:
-        options.kwargs['fd'].write("\n]\n")
+        options.kwargs['fd'].write(b"\n]\n")
 
 
-def export(options, service):
-    """ main export method: export any number of indexes """
+def manifest_path(options):
+    """ file name of the checkpoint manifest of the export """
+
+    return options.kwargs['output'] + MANIFEST_SUFFIX
+
+
+def load_manifest(options):
+    """ load the checkpoint manifest of an interrupted export, if there is
+        one that matches the export options """
+
+    try:
+        with open(manifest_path(options), "r") as fpd:
+            manifest = Record(json.load(fpd))
+    except (IOError, ValueError):
+        return None
+
+    for key in ['search', 'index', 'omode', 'compress']:
+        if manifest.get(key) != options.kwargs[key]:
+            print(f"Manifest {manifest_path(options)} was written with "
+                  f"--{key}={manifest.get(key)}")
+            sys.exit(1)
+    manifest.slices = [Record(piece) for piece in manifest.slices]
+    return manifest
+
+
+def checkpoint(options, piece=None, **changes):
+    """ apply the changes to the slice, or to the manifest itself, and write
+        the manifest atomically """
+
+    manifest = options.kwargs['manifest']
+    with manifest.lock:
+        (manifest if piece is None else piece).update(changes)
+        content = {key: value for key, value in manifest.items()
+                   if key != 'lock'}
+        temp = manifest_path(options) + ".tmp"
+        with open(temp, "w") as fpd:
+            json.dump(content, fpd, indent=1)
+            fpd.flush()
+            os.fsync(fpd.fileno())
+        os.replace(temp, manifest_path(options))
+
+
+def index_bounds(options, service):
+    """ get the earliest/latest event time of the exported index with a
+        cheap tstats pass """
+
+    query = f"| tstats count min(_time) as earliest max(_time) as latest " \
+            f"where index={options.kwargs['index']}"
+    response = service.jobs.oneshot(query, output_mode="json")
+    for result in JSONResultsReader(response):
+        if isinstance(result, dict) and result.get('earliest'):
+            return float(result['earliest']), float(result['latest']) + 1
+    return None
+
+
+def event_histogram(options, service, earliest, latest):
+    """ count the events of the exported index per time bucket with a
+        cheap tstats pass, returns the bucket span in seconds and the
+        (bucket start, count) tuples, newest first """
+
+    span = max(math.ceil((latest - earliest) / HISTOGRAM_BUCKETS), 1)
+    query = f"| tstats count where index={options.kwargs['index']} " \
+            f"by _time span={span}s | eval bucket=_time | fields bucket count"
+    response = service.jobs.oneshot(query, output_mode="json", count=0,
+                                    earliest_time=f"{earliest:.3f}",
+                                    latest_time=f"{latest:.3f}")
+    buckets = []
+    for result in JSONResultsReader(response):
+        if isinstance(result, dict) and result.get('bucket'):
+            buckets.append((float(result['bucket']), int(result['count'])))
+    return span, sorted(buckets, reverse=True)
+
+
+def cut_slices(earliest, latest, span, buckets, target):
+    """ cut the range at bucket edges into slices of at most target events,
+        returns the slice edges from latest down to earliest """
+
+    edges = [latest]
+    count = 0
+    for start, events in buckets:
+        top = min(start + span, latest)
+        bottom = max(start, earliest)
+        if count > 0 and count + events > target:
+            edges.append(top)
+            count = 0
+        if events > target:
+            # assume an even spread of the events within a dense bucket
+            parts = math.ceil(events / target)
+            width = (top - bottom) / parts
+            edges.extend(top - part * width for part in range(1, parts))
+            edges.append(bottom)
+        else:
+            count += events
+    edges.append(earliest)
+
+    # drop the empty slices
+    return [edge for number, edge in enumerate(edges)
+            if number == 0 or edge < edges[number - 1] and edge >= earliest]
+
+
+def new_slice(number, earliest, latest):
+    """ a time slice along with its checkpoint: the committed offset in the
+        slice's output, the _time of the last committed event and the
+        number of committed events """
+
+    return Record(number=number, earliest=earliest, latest=latest,
+                  state="pending", offset=None, last_time=None, events=0)
+
+
+def plan_slices(options, service):
+    """ cut the start/end range into the time slices to export, newest
+        slice first """
 
     start = options.kwargs['start']
     end = options.kwargs['end']
-    fixtail = options.kwargs['fixtail']
-    once = True
+    nslices = max(options.kwargs['slices'], 1)
+    limit = options.kwargs['limit']
+
+    if nslices == 1 and limit <= 0:
+        return [new_slice(0, start, end)]
+
+    bounds = None
+    if start == "" or end == "":
+        bounds = index_bounds(options, service)
+        if bounds is None:
+            # nothing to slice, export the range as is
+            return [new_slice(0, start, end)]
+
+    earliest = float(start) if start != "" else bounds[0]
+    latest = float(end) if end != "" else bounds[1]
+
+    if limit > 0:
+        span, buckets = event_histogram(options, service, earliest, latest)
+        total = sum(events for _, events in buckets)
+        target = min(limit, max(math.ceil(total / nslices), 1))
+        edges = cut_slices(earliest, latest, span, buckets, target)
+    else:
+        width = (latest - earliest) / nslices
+        edges = [latest - number * width for number in range(nslices)]
+        edges.append(earliest)
+
+    return [new_slice(number, f"{edges[number + 1]:.3f}", f"{edges[number]:.3f}")
+            for number in range(len(edges) - 1)]
+
+
+def export_slice(options, service, piece, fdout):
+    """ export one time slice to the given binary file, retrying the slice
+        on its own when it fails. A retry resumes the slice from its last
+        checkpoint """
 
     squery = options.kwargs['search']
     squery = squery + f" index={options.kwargs['index']}"
-    if start != "":
-        squery = squery + f" earliest_time={start}"
-    if end != "":
-        squery = squery + f" latest_time={end}"
-
-    success = False
-
-    while not success:
-        # issue query to splunkd
-        # count=0 overrides the maximum number of events
-        # returned (normally 50K) regardless of what the .conf
-        # file for splunkd says.
-        result = service.get('search/jobs/export',
-                             search=squery,
-                             output_mode=options.kwargs['omode'],
-                             timeout=60,
-                             earliest_time="0.000",
-                             time_format="%s.%Q",
-                             count=0)
-
-        if result.status != 200:
-            print(f"warning: export job failed: {result.status}, sleep/retry")
-            time.sleep(60)
+    event_format = stream_format(options)
+    meter = options.kwargs['meter']
+
+    if piece.offset is None:
+        checkpoint(options, piece, offset=fdout.tell())
+
+    attempts = max(options.kwargs['attempts'], 1)
+    for attempt in range(1, attempts + 1):
+        resumed = piece.last_time is not None
+        try:
+            recent = []
+            if resumed:
+                # the files are opened for reading too, for the tail of the
+                # slice written so far
+                recent = recent_events(fdout, piece.offset, event_format)
+            fdout.seek(piece.offset)
+            fdout.truncate()
+
+            # the slice bounds are passed as export arguments rather than in
+            # the search string so that every slice can reuse the same query.
+            # A resumed slice continues from the last committed _time,
+            # including it when the events written at that _time can be told
+            # apart, events are exported newest first
+            kwargs_export = {'earliest_time': piece.earliest or "0.000"}
+            latest = piece.latest
+            if resumed:
+                latest = piece.last_time
+                if any(key is not None for key, _ in recent):
+                    latest = f"{float(piece.last_time) + 0.001:.3f}"
+            if latest != "":
+                kwargs_export['latest_time'] = latest
+
+            # issue query to splunkd
+            # count=0 overrides the maximum number of events
+            # returned (normally 50K) regardless of what the .conf
+            # file for splunkd says.
+            result = service.get('search/jobs/export',
+                                 search=squery,
+                                 output_mode=event_format,
+                                 timeout=60,
+                                 time_format="%s.%Q",
+                                 count=0,
+                                 **kwargs_export)
+
+            if resumed and event_format == "xml":
+                # close the results element cut at the checkpoint
+                fdout.write(b"</results>\n")
+            base = fdout.tell()
+            splitter = RecordSplitter(event_format)
+            dedup = Deduplicator(splitter, recent)
+            events = piece.events
+            run_time = None
+            run_end = None
+            dropped = 0
+            written = 0
+            commit = None
+
+            # write export file
+            for content in iter_blocks(result.body, CHUNK_SIZE):
+                position = splitter.fed
+                records = splitter.feed(content)
+                if resumed and event_format == "csv":
+                    # drop the header that repeats at the start of a
+                    # resumed csv slice
+                    if splitter.time_column is None:
+                        dropped += len(content)
+                        continue
+                    if position < splitter.header_end:
+                        cut = splitter.header_end - position
+                        content = content[cut:]
+                        dropped += cut
+                        position += cut
+                content, records = dedup.feed(content, position, records)
+                fdout.write(content)
+                written += len(content)
+
+                for offset, length, event_time in records:
+                    if event_time != run_time:
+                        if run_time is not None:
+                            commit = (run_end, run_time, events)
+                        run_time = event_time
+                    run_end = base + offset + length - dropped
+                    events += 1
+                meter.update(piece, len(content), len(records), run_time)
+                if commit is not None and written >= CHECKPOINT_SIZE:
+                    fdout.flush()
+                    os.fsync(fdout.fileno())
+                    checkpoint(options, piece, offset=commit[0],
+                               last_time=commit[1], events=commit[2])
+                    commit = None
+                    written = 0
+            fdout.write(dedup.flush())
+            fdout.flush()
+            os.fsync(fdout.fileno())
+            checkpoint(options, piece, state="done", offset=fdout.tell(),
+                       last_time=run_time or piece.last_time, events=events)
+            meter.finish(piece, "done")
+            return piece
+        except (HTTPError, HTTPException, OSError) as e:
+            if attempt == attempts:
+                meter.finish(piece, "failed")
+                raise
+            meter.finish(piece, "retrying")
+            delay = min(2 ** attempt, 60)
+            print(f"warning: export of slice {piece.number} failed: {e}, "
+                  f"retry {attempt}/{attempts - 1} in {delay}s")
+            time.sleep(delay)
+
+
+def part_path(options, piece):
+    """ file name of the part file that holds a single slice """
+
+    return f"{options.kwargs['output']}.{piece.number:04d}.part"
+
+
+def stitch(options, slices, futures, writer):
+    """ append the part files to the export file, newest slice first, as
+        soon as each slice is exported, and remove them. Each appended part
+        is checkpointed, so that an interrupted stitch resumes with the next
+        part """
+
+    manifest = options.kwargs['manifest']
+    event_format = stream_format(options)
+    header = manifest.header.encode() if manifest.header else None
+    recent = []
+    for piece in slices:
+        if piece.number in futures:
+            # wait for the slice to be exported
+            futures[piece.number].result()
+        if piece.state != "stitched":
+            with open(part_path(options, piece), "rb") as fdin:
+                line = None
+                if event_format == "csv":
+                    # every slice starts with its own csv header, only keep
+                    # the ones that change the columns
+                    line = fdin.readline()
+                    if line != header:
+                        writer.write(line)
+                        header = line
+                # drop the events of the previous slice that the head of
+                # this one repeats
+                splitter = RecordSplitter(event_format, header=line)
+                dedup = Deduplicator(splitter, recent)
+                # the writer thread holds on to the blocks, so they are
+                # read into buffers of their own
+                while True:
+                    content = fdin.read(CHUNK_SIZE)
+                    if len(content) == 0:
+                        break
+                    if dedup.active:
+                        position = splitter.fed
+                        content, _ = dedup.feed(content, position,
+                                                splitter.feed(content))
+                    writer.write(content)
+                rest = dedup.flush()
+                if rest:
+                    writer.write(rest)
+                recent = recent_events(fdin, fdin.seek(0, 2), event_format)
+            options.kwargs['meter'].finish(piece, "stitched")
+            if writer.resumable:
+                piece.state = "stitched"
+                checkpoint(options, stitched=writer.commit(),
+                           header=header.decode() if header else None)
+                os.remove(part_path(options, piece))
         else:
-            success = True
+            # the part is gone, its tail is not looked up
+            recent = []
+    writer.close()
+
+    for piece in slices:
+        if os.path.exists(part_path(options, piece)):
+            os.remove(part_path(options, piece))
+
+
+def export(options, service):
+    """ main export method: export any number of indexes """
+
+    fd = options.kwargs['fd']
+    if options.kwargs['fixtail']:
+        cleanup_tail(options)
+
+    manifest = options.kwargs['manifest']
+    if manifest is None:
+        manifest = Record(search=options.kwargs['search'],
+                          index=options.kwargs['index'],
+                          omode=options.kwargs['omode'],
+                          compress=options.kwargs['compress'],
+                          stitched=fd.tell(), header=None,
+                          slices=plan_slices(options, service))
+        options.kwargs['manifest'] = manifest
+    manifest.lock = threading.Lock()
+    checkpoint(options)
+
+    slices = manifest.slices
+    options.kwargs['meter'] = Progress(options, slices)
+    try:
+        export_slices(options, service, slices)
+    finally:
+        options.kwargs['meter'].stop()
+
+    os.remove(manifest_path(options))
+
+
+def export_slices(options, service, slices):
+    """ export the slices, straight to the export file or through part
+        files """
+
+    fd = options.kwargs['fd']
+    manifest = options.kwargs['manifest']
+    if len(slices) == 1 and options.kwargs['compress'] == "none" and \
+            options.kwargs['omode'] != "parquet":
+        # a single plain slice is exported straight to the export file
+        if slices[0].state == "pending":
+            export_slice(options, service, slices[0], fd)
+    else:
+        # drop whatever an interrupted stitch left behind
+        fd.seek(manifest.stitched)
+        fd.truncate()
+        writer = open_writer(options, fd)
+
+        def run(piece):
+            part = part_path(options, piece)
+            with open(part, "r+b" if os.path.exists(part) else "w+b") as fdout:
+                return export_slice(options, service, piece, fdout)
+
+        concurrency = max(options.kwargs['concurrency'], 1)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {piece.number: pool.submit(run, piece)
+                       for piece in slices if piece.state == "pending"}
+            stitch(options, slices, futures, writer)
+
+
+def list_indexes(options, service):
+    """ the names of the enabled indexes that match the --index glob,
+        internal indexes only match a glob that starts with an underscore """
+
+    pattern = options.kwargs['index']
+    return sorted(index.name for index in service.indexes
+                  if fnmatchcase(index.name, pattern) and
+                  (pattern.startswith("_") or not index.name.startswith("_"))
+                  and index.content.get('disabled') != "1")
+
 
-    # write export file
-    while True:
-        if fixtail and once:
-            cleanup_tail(options)
-            once = False
-        content = result.body.read()
-        if len(content) == 0:
-            break
-        options.kwargs['fd'].write(content)
-        options.kwargs['fd'].write("\n")
+def index_options(options, name):
+    """ the options of the export of a single index of a fan-out export,
+        its output is the directory of its shards """
 
-    options.kwargs['fd'].flush()
+    kwargs = dict(options.kwargs, index=name, manifest=None,
+                  output=os.path.join(options.kwargs['output'], name))
+    return Record(kwargs=kwargs, args=options.args)
+
+
+def shard_path(options, piece):
+    """ file name of the shard that holds a single slice of an index """
+
+    name = f"{piece.number:04d}.{options.kwargs['omode']}"
+    if options.kwargs['omode'] != "parquet":
+        name += SHARD_SUFFIXES[options.kwargs['compress']]
+    return os.path.join(options.kwargs['output'], name)
+
+
+def export_shard(options, service, piece):
+    """ export one slice of an index to a part file, then move or encode it
+        into its shard """
+
+    shard = shard_path(options, piece)
+    part = shard + ".part"
+    if piece.state == "pending":
+        with open(part, "r+b" if os.path.exists(part) else "w+b") as fdout:
+            export_slice(options, service, piece, fdout)
+
+    if options.kwargs['compress'] == "none" and \
+            options.kwargs['omode'] != "parquet":
+        if os.path.exists(part):
+            os.replace(part, shard)
+    else:
+        with open(shard, "wb") as fd:
+            writer = open_writer(options, fd)
+            with open(part, "rb") as fdin:
+                while True:
+                    content = fdin.read(CHUNK_SIZE)
+                    if len(content) == 0:
+                        break
+                    writer.write(content)
+            writer.close()
+    checkpoint(options, piece, state="stitched")
+    if os.path.exists(part):
+        os.remove(part)
+    options.kwargs['meter'].finish(piece, "stitched")
+    return piece
+
+
+def export_indexes(options, service):
+    """ fan-out export: export every index that matches --index to shards
+        of its own, with a single pool of workers for all their slices.
+        Returns the number of indexes that could not be planned and of
+        slices that failed """
+
+    indexes = []
+    failed = 0
+    for name in list_indexes(options, service):
+        index = index_options(options, name)
+        manifest = load_manifest(index)
+        if manifest is None:
+            if os.path.exists(index.kwargs['output']):
+                print(f"Skipping index {name}, already exported to "
+                      f"{index.kwargs['output']}")
+                continue
+            try:
+                slices = plan_slices(index, service)
+            except (HTTPError, HTTPException, OSError) as e:
+                print(f"error: planning the export of index {name} "
+                      f"failed: {e}")
+                failed += 1
+                continue
+            manifest = Record(search=options.kwargs['search'], index=name,
+                              omode=options.kwargs['omode'],
+                              compress=options.kwargs['compress'],
+                              slices=slices)
+        for piece in manifest.slices:
+            piece.index = name
+        manifest.lock = threading.Lock()
+        index.kwargs['manifest'] = manifest
+        # the manifest sits next to the shard directory, and is written
+        # first: a directory without one is an index fully exported
+        checkpoint(index)
+        os.makedirs(index.kwargs['output'], exist_ok=True)
+        indexes.append(index)
+
+    slices = [piece for index in indexes
+              for piece in index.kwargs['manifest'].slices]
+    meter = Progress(options, slices)
+    try:
+        concurrency = max(options.kwargs['concurrency'], 1)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = []
+            for index in indexes:
+                index.kwargs['meter'] = meter
+                futures.extend((piece, pool.submit(export_shard, index,
+                                                   service, piece))
+                               for piece in index.kwargs['manifest'].slices
+                               if piece.state != "stitched")
+            for piece, future in futures:
+                try:
+                    future.result()
+                except (HTTPError, HTTPException, OSError) as e:
+                    print(f"error: export of index {piece.index} slice "
+                          f"{piece.number} failed: {e}")
+                    failed += 1
+    finally:
+        meter.stop()
+
+    # the manifest of an index goes once all its shards are written
+    for index in indexes:
+        if all(piece.state == "stitched"
+               for piece in index.kwargs['manifest'].slices):
+            os.remove(manifest_path(index))
+    return failed
 
 
 def main():
@@ -358,19 +1251,50 @@ def main():
         print(f"output mode must be one of {OUTPUT_MODES}, found {options.kwargs['omode']}")
         sys.exit(1)
 
+    if options.kwargs['compress'] not in COMPRESSIONS:
+        print(f"compression must be one of {COMPRESSIONS}, found {options.kwargs['compress']}")
+        sys.exit(1)
+
+    if options.kwargs['compress'] == "zstd" and zstandard is None:
+        print("zstd compression requires the zstandard package")
+        sys.exit(1)
+
+    if options.kwargs['omode'] == "parquet" and pyarrow is None:
+        print("parquet output requires the pyarrow package")
+        sys.exit(1)
+
     service = connect(**options.kwargs)
 
+    if options.kwargs['fanout']:
+        if os.path.exists(options.kwargs['output']) and \
+                not options.kwargs['recover']:
+            print(f"Export directory {options.kwargs['output']} exists, and recover option nor specified")
+            sys.exit(1)
+        os.makedirs(options.kwargs['output'], exist_ok=True)
+        if export_indexes(options, service) > 0:
+            sys.exit(1)
+        return
+
+    options.kwargs['manifest'] = None
+    options.kwargs['fixtail'] = False
     if os.path.exists(options.kwargs['output']):
         if not options.kwargs['recover']:
             print(f"Export file {options.kwargs['output']} exists, and recover option nor specified")
             sys.exit(1)
+        options.kwargs['manifest'] = load_manifest(options)
+        if options.kwargs['manifest'] is not None:
+            # resume from the checkpoints
+            openmode = "r+b"
+        elif options.kwargs['compress'] != "none" or \
+                options.kwargs['omode'] == "parquet":
+            print(f"Export file {options.kwargs['output']} has no manifest to recover from")
+            sys.exit(1)
         else:
             options.kwargs['end'] = recover(options)
             options.kwargs['fixtail'] = True
-            openmode = "a"
+            openmode = "a+b"
     else:
-        openmode = "w"
-        options.kwargs['fixtail'] = False
+        openmode = "w+b"
 
     try:
         options.kwargs['fd'] = open(options.kwargs['output'], openmode)
@@ -15,42 +15,134 @@
 # under the License.
 
 """Follows (aka tails) a realtime search using the job endpoints and prints
-   results to stdout."""
+   results to stdout.
+
+   Every poll only reads the events past the high-water mark. For a
+   transforming search the preview is only read when a new one is out, and
+   only the rows that changed since the previous preview are printed, rows
+   being told apart by their --key fields (default is the first field).
+
+   The poll interval follows the rate of new results, so that a poll reads
+   about BATCH_SIZE of them, between POLL_MIN and POLL_MAX seconds. Results
+   are printed by a writer thread from a bounded queue, a slow terminal holds
+   back the polling instead of piling up results."""
 
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+import queue
+import threading
 import time
-from pprint import pprint
+from pprint import pformat
 
 from splunklib import client
-from splunklib import results
 
 import utils
+from columns import read_columns
+
+# Seconds between two polls of the job
+POLL_MIN = 0.5
+POLL_MAX = 10.0
+
+# Number of results a poll aims to read
+BATCH_SIZE = 100
+
+# Number of batches of results waiting to be printed
+QUEUE_SIZE = 100
+
+RULES = {
+    'key': {
+        'flags': ["--key"],
+        'default': "",
+        'help': "Comma separated fields that identify a row of a transforming search (default is the first field)"
+    }
+}
+
+
+class Writer(threading.Thread):
+    """Print batches of results from a bounded queue."""
+
+    def __init__(self, out=sys.stdout):
+        threading.Thread.__init__(self, daemon=True)
+        self.out = out
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.start()
 
+    def put(self, rows):
+        """Queue a batch of results, blocks while the queue is full."""
+        self.queue.put(rows)
 
-def follow(job, count, items):
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            rows = self.queue.get()
+            if rows is None:
+                return
+            self.out.write("".join(pformat(row) + "\n" for row in rows))
+            self.out.flush()
+
+
+def next_interval(interval, count):
+    """The poll interval that reads about BATCH_SIZE results at the rate seen
+       over the last interval, backing off while nothing comes in."""
+    if count == 0:
+        return min(interval * 2, POLL_MAX)
+    rate = count / interval
+    return min(max(BATCH_SIZE / rate, POLL_MIN), POLL_MAX)
+
+
+def follow_events(job, writer):
     offset = 0  # High-water mark
+    interval = POLL_MIN
     while True:
-        total = count()
-        if total <= offset:
-            time.sleep(1)  # Wait for something to show up
-            job.refresh()
-            continue
-        stream = items(offset + 1)
-        for event in results.JSONResultsReader(stream):
-            pprint(event)
-        offset = total
+        time.sleep(interval)
+        job.refresh()
+        count = max(int(job['eventCount']) - offset, 0)
+        if count > 0:
+            stream = job.events(offset=offset, count=count,
+                                output_mode='json_cols')
+            writer.put(list(read_columns(stream).rows()))
+            offset += count
+        interval = next_interval(interval, count)
+
+
+def follow_preview(job, writer, key):
+    previews = 0  # High-water mark
+    rows = {}  # the rows of the last preview, by key
+    interval = POLL_MIN
+    while True:
+        time.sleep(interval)
+        job.refresh()
+        changed = []
+        if int(job['numPreviews']) > previews:
+            previews = int(job['numPreviews'])
+            columns = read_columns(job.preview(output_mode='json_cols',
+                                               count=0))
+            fields = key or columns.names[:1]
+            current = {}
+            for row in columns.rows():
+                row_key = tuple(str(row.get(field)) for field in fields)
+                if rows.get(row_key) != row:
+                    changed.append(row)
+                current[row_key] = row
+            rows = current
+            if changed:
+                writer.put(changed)
+        interval = next_interval(interval, len(changed))
 
 
 def main():
     usage = "usage: follow.py <search>"
-    opts = utils.parse(sys.argv[1:], {}, ".env", usage=usage)
+    opts = utils.parse(sys.argv[1:], RULES, ".env", usage=usage)
 
     if len(opts.args) != 1:
         utils.error("Search expression required", 2)
         print("ok")
     search = opts.args[0]
+    key = [field for field in opts.kwargs['key'].split(",") if field]
 
     service = client.connect(**opts.kwargs)
 
@@ -68,18 +160,16 @@ def main():
             break
         time.sleep(2)  # Wait
 
-    if job['reportSearch'] is not None:  # Is it a transforming search?
-        count = lambda: int(job['numPreviews'])
-        items = lambda _: job.preview(output_mode='json')
-    else:
-        count = lambda: int(job['eventCount'])
-        items = lambda offset: job.events(offset=offset, output_mode='json')
-
+    writer = Writer()
     try:
-        follow(job, count, items)
+        if job['reportSearch'] is not None:  # Is it a transforming search?
+            follow_preview(job, writer, key)
+        else:
+            follow_events(job, writer)
     except KeyboardInterrupt:
         print("\nInterrupted.")
     finally:
+        writer.close()
         job.cancel()
 
 
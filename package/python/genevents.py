@@ -14,23 +14,45 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""A tool to generate event data to a named index."""
+"""A tool to generate event data to a named index.
+
+   --workers threads each send their share of --count events, --batch
+   events at a time, over a connection of their own: the streaming
+   receiver (stream), the simple receiver (submit), a tcp input (tcp) or
+   the HTTP Event Collector (hec, with --hec-token). The workers share a
+   token bucket that paces them to --rate events per second in total.
+
+   Events are made from --template, where {time} is the time, {worker} and
+   {seq} the worker and event numbers, and {host} and {user} are drawn from
+   --cardinality distinct values; they are padded to --size bytes.
+
+   Once done, the achieved and the target rates are reported along with the
+   percentiles of the latency of a batch: the time to hand it to the socket
+   for stream and tcp, the round trip of its request for submit and hec."""
 
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 import datetime
+import random
 import socket
+import threading
 import time
 
-from splunklib.client import connect
-
+from hec import HECClient
+from jobrunner import connect
 from utils import parse
 
 SPLUNK_HOST = "localhost"
 SPLUNK_PORT = 9002
+HEC_PORT = 8088
 
-INGEST_TYPE = ["stream", "submit", "tcp"]
+INGEST_TYPE = ["stream", "submit", "tcp", "hec"]
+
+TEMPLATE = "{time}: event worker {worker}, number {seq} host=host{host} user=user{user}"
+
+# Seconds between two progress reports
+REPORT_INTERVAL = 5
 
 RULES = {
     'ingest': {
@@ -43,19 +65,229 @@ RULES = {
         'default': "127.0.0.1",
         'help': "input host when using tcp ingest, default is localhost"
     },
-    'type': {
+    'inputport': {
         'flags': ["--inputport"],
         'default': SPLUNK_PORT,
+        'type': "int",
         'help': f"input host port when using tcp ingest, default is {SPLUNK_PORT}"
     },
+    'hec_url': {
+        'flags': ["--hec-url"],
+        'default': "",
+        'help': f"collector url when using hec ingest, default is https://<host>:{HEC_PORT}"
+    },
+    'hec_token': {
+        'flags': ["--hec-token"],
+        'default': "",
+        'help': "collector token when using hec ingest"
+    },
+    'workers': {
+        'flags': ["--workers"],
+        'default': 1,
+        'type': "int",
+        'help': "number of parallel senders, default is 1"
+    },
+    'rate': {
+        'flags': ["--rate"],
+        'default': 5000,
+        'type': "float",
+        'help': "target events per second of all the senders, 0 for no limit, default is 5000"
+    },
+    'count': {
+        'flags': ["--count"],
+        'default': 50000,
+        'type': "int",
+        'help': "number of events to send, default is 50000"
+    },
+    'batch': {
+        'flags': ["--batch"],
+        'default': 100,
+        'type': "int",
+        'help': "events sent at a time, default is 100"
+    },
+    'size': {
+        'flags': ["--size"],
+        'default': 0,
+        'type': "int",
+        'help': "pad events to this many bytes, default is no padding"
+    },
+    'cardinality': {
+        'flags': ["--cardinality"],
+        'default': 10,
+        'type': "int",
+        'help': "number of distinct {host} and {user} values, default is 10"
+    },
+    'template': {
+        'flags': ["--template"],
+        'default': TEMPLATE,
+        'help': "event template, with {time}, {worker}, {seq}, {host} and {user} fields"
+    },
 }
 
 
+class TokenBucket:
+    """Pace the callers to rate tokens per second, in bursts of up to burst
+       tokens."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = 0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, count):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def percentile(values, fraction):
+    """The value below which the given fraction of the sorted values are."""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Worker(threading.Thread):
+    """Send a share of the events over a transport of its own."""
+
+    def __init__(self, number, count, send, bucket, opts, stopped):
+        super().__init__(daemon=True)
+        self.number = number
+        self.count = count
+        self.send = send
+        self.bucket = bucket
+        self.stopped = stopped
+        self.batch = opts.kwargs['batch']
+        self.size = opts.kwargs['size']
+        self.cardinality = max(opts.kwargs['cardinality'], 1)
+        self.template = opts.kwargs['template']
+        self.events = 0
+        self.bytes = 0
+        self.latencies = []
+        self.error = None
+
+    def events_of(self, first, count):
+        now = datetime.datetime.now().isoformat()
+        lines = []
+        for seq in range(first, first + count):
+            line = self.template.format(
+                time=now, worker=self.number, seq=seq,
+                host=random.randrange(self.cardinality),
+                user=random.randrange(self.cardinality))
+            if len(line) < self.size:
+                line += " pad=" + "x" * max(self.size - len(line) - 5, 0)
+            lines.append(line)
+        return lines
+
+    def run(self):
+        try:
+            sent = 0
+            while sent < self.count and not self.stopped.is_set():
+                count = min(self.batch, self.count - sent)
+                if self.bucket is not None:
+                    self.bucket.take(count)
+                lines = self.events_of(sent, count)
+                start = time.perf_counter()
+                self.bytes += self.send(lines)
+                self.latencies.append(time.perf_counter() - start)
+                sent += count
+                self.events = sent
+        except Exception as e:
+            self.error = e
+
+
+def transport(service, opts, index):
+    """A function that makes the sender of a worker: a function that sends
+       a list of events and returns the number of bytes sent."""
+    itype = opts.kwargs['ingest']
+
+    if itype == "stream":
+        def sender():
+            stream = index.attach()
+
+            def send(lines):
+                data = ("\n".join(lines) + "\n").encode()
+                stream.sendall(data)
+                return len(data)
+            return send
+    elif itype == "submit":
+        def sender():
+            def send(lines):
+                data = ("\n".join(lines) + "\n").encode()
+                index.submit(data)
+                return len(data)
+            return send
+    elif itype == "tcp":
+        # create a tcp input if one doesn't exist
+        input_host = opts.kwargs['inputhost']
+        input_port = opts.kwargs['inputport']
+        if (str(input_port), "tcp") not in service.inputs:
+            service.inputs.create(str(input_port), "tcp", index=index.name)
+
+        def sender():
+            ingest = socket.create_connection((input_host, input_port))
+
+            def send(lines):
+                data = ("\n".join(lines) + "\n").encode()
+                ingest.sendall(data)
+                return len(data)
+            return send
+    else:
+        url = opts.kwargs['hec_url'] or \
+            f"https://{opts.kwargs.get('host', SPLUNK_HOST)}:{HEC_PORT}"
+        token = opts.kwargs['hec_token']
+        if not token:
+            print("hec ingest requires --hec-token")
+            sys.exit(1)
+
+        def sender():
+            hec = HECClient(url, token, flush_interval=0,
+                            batch_count=sys.maxsize, batch_size=sys.maxsize,
+                            index=index.name)
+
+            def send(lines):
+                for line in lines:
+                    hec.send(line)
+                size = hec.bytes
+                hec.flush()
+                return hec.bytes - size
+            return send
+
+    return sender
+
+
+def report(workers, target, elapsed, final=False):
+    events = sum(worker.events for worker in workers)
+    size = sum(worker.bytes for worker in workers)
+    rate = events / elapsed if elapsed else 0
+    line = f"{events} events in {elapsed:.1f}s: {rate:.0f} events/s"
+    if target:
+        line += f" of {target:.0f} targeted ({rate / target:.0%})"
+    line += f", {size / 2 ** 20 / elapsed if elapsed else 0:.2f} MB/s"
+    print(line)
+    if final:
+        latencies = sorted(latency * 1000 for worker in workers
+                           for latency in worker.latencies)
+        print(f"batch latency ms: p50 {percentile(latencies, 0.5):.2f} "
+              f"p90 {percentile(latencies, 0.9):.2f} "
+              f"p99 {percentile(latencies, 0.99):.2f} "
+              f"max {latencies[-1] if latencies else 0:.2f}")
+
+
 def feed_index(service, opts):
     """Feed the named index in a specific manner."""
 
     indexname = opts.args[0]
-    itype = opts.kwargs['ingest']
 
     # get index handle
     try:
@@ -64,48 +296,45 @@ def feed_index(service, opts):
         print(f"Index {indexname} not found")
         return
 
-    if itype in ["stream", "submit"]:
-        stream = index.attach()
-    else:
-        # create a tcp input if one doesn't exist
-        input_host = opts.kwargs.get("inputhost", SPLUNK_HOST)
-        input_port = int(opts.kwargs.get("inputport", SPLUNK_PORT))
-        input_name = f"tcp:{input_port}"
-        if input_name not in service.inputs.list():
-            service.inputs.create("tcp", input_port, index=indexname)
-        # connect to socket
-        ingest = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        ingest.connect((input_host, input_port))
-
-    count = 0
-    lastevent = ""
-
-    try:
-        for i in range(0, 10):
-            for j in range(0, 5000):
-                lastevent = f"{datetime.datetime.now().isoformat()}: event bunch {i}, number {j}\n"
-
-                lastevent = (lastevent + "\n").encode()
-
-                if itype == "stream":
-                    stream.write(lastevent)
-                elif itype == "submit":
-                    index.submit(lastevent)
-                else:
-                    ingest.send(lastevent)
-
-                count = count + 1
+    sender = transport(service, opts, index)
+    count = opts.kwargs['count']
+    nworkers = max(opts.kwargs['workers'], 1)
+    rate = opts.kwargs['rate']
+    batch = opts.kwargs['batch']
+    bucket = TokenBucket(rate, max(batch, rate / 10)) if rate else None
+    stopped = threading.Event()
 
-            print(f"submitted {count} events, sleeping 1 second")
-            time.sleep(1)
+    workers = [Worker(number, count // nworkers + (number < count % nworkers),
+                      sender(), bucket, opts, stopped)
+               for number in range(nworkers)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
 
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(REPORT_INTERVAL / len(workers))
+            if any(worker.is_alive() for worker in workers):
+                report(workers, rate, time.monotonic() - start)
     except KeyboardInterrupt:
-        print("^C detected, last event written:")
-        print(lastevent)
+        print("^C detected, stopping")
+        stopped.set()
+        for worker in workers:
+            worker.join()
+
+    report(workers, rate, time.monotonic() - start, final=True)
+    failed = False
+    for worker in workers:
+        if worker.error is not None:
+            print(f"worker {worker.number} failed: {worker.error}")
+            failed = True
+    if failed:
+        sys.exit(1)
 
 
 def main():
-    usage = "usage: %prog [options] <command> [<args>]"
+    usage = "usage: %prog [options] <index>"
 
     argv = sys.argv[1:]
     if len(argv) == 0:
@@ -113,12 +342,13 @@ def main():
         sys.exit(1)
 
     opts = parse(argv, RULES, ".env", usage=usage)
-    service = connect(**opts.kwargs)
 
     if opts.kwargs['ingest'] not in INGEST_TYPE:
         print("ingest type must be in set %s" % INGEST_TYPE)
         sys.exit(1)
 
+    service = connect(**opts.kwargs)
+
     feed_index(service, opts)
 
 
@@ -21,16 +21,14 @@ a search Job by its sid.
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
-import time
-
-from splunklib import client
 
+from jobrunner import connect, wait_job
 from utils import parse
 
 
 def main(argv):
     opts = parse(argv, {}, ".env")
-    service = client.connect(**opts.kwargs)
+    service = connect(**opts.kwargs)
 
     # Execute a simple search, and store the sid
     sid = service.search("search index=_internal | head 5").sid
@@ -39,8 +37,7 @@ def main(argv):
     job = service.job(sid)
 
     # Wait for the job to complete
-    while not job.is_done():
-        time.sleep(1)
+    wait_job(service, job)
 
     print(f"Number of events found: {int(job['eventCount'])}")
 
@@ -0,0 +1,267 @@
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Sends events to the HTTP Event Collector (HEC) in batches.
+
+Events are queued and posted as one multi-event payload once BATCH_COUNT
+events or BATCH_SIZE bytes are queued, or FLUSH_INTERVAL seconds after the
+previous batch, gzip compressed, over keep-alive connections that are reused
+between batches.
+
+    with HECClient("https://localhost:8088", token, sourcetype="_json") as hec:
+        for event in events:
+            hec.send(event)
+
+With ack=True the batches are sent on a channel with indexer acknowledgement:
+the ack ids are polled, and a batch that is not acknowledged within
+ACK_TIMEOUT seconds is sent again, up to ATTEMPTS times. close() waits until
+every batch is acknowledged.
+
+A batch that fails with a connection or protocol error or a 429 or 5xx status is retried
+with a backoff. Errors of the background flush are raised by the next call
+to send(), flush() or close().
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import gzip
+import json
+import threading
+import time
+import uuid
+from http.client import HTTPException
+
+try:
+    from jobrunner import pooled_handler
+except ImportError:
+    from python.jobrunner import pooled_handler
+
+__all__ = ["HECClient", "HECError"]
+
+# Events and bytes (before compression) per batch
+BATCH_COUNT = 1000
+BATCH_SIZE = 1024 * 1024
+
+# Seconds before a partial batch is sent
+FLUSH_INTERVAL = 1.0
+
+# Number of times a batch is sent before it fails
+ATTEMPTS = 5
+
+# Seconds before an unacknowledged batch is sent again
+ACK_TIMEOUT = 60
+
+# zlib's default level, several times faster than gzip's 9
+GZIP_LEVEL = 6
+
+# Statuses of the batches tried again
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+EVENT_PATH = "/services/collector/event"
+ACK_PATH = "/services/collector/ack"
+
+
+class HECError(Exception):
+    def __init__(self, status, text):
+        super().__init__(f"HEC {status}: {text}")
+        self.status = status
+        self.text = text
+
+
+class HECClient:
+    """Queue events and post them to the collector in batches. The given
+       fields (index, source, sourcetype, host) are the defaults of every
+       event."""
+
+    def __init__(self, url, token, compress=True, ack=False, channel=None,
+                 batch_count=BATCH_COUNT, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, attempts=ATTEMPTS,
+                 ack_timeout=ACK_TIMEOUT, verify=False, timeout=None,
+                 **fields):
+        self.url = url.rstrip("/")
+        self.compress = compress
+        self.ack = ack
+        self.channel = channel or (str(uuid.uuid4()) if ack else None)
+        self.batch_count = batch_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.attempts = attempts
+        self.ack_timeout = ack_timeout
+        self.fields = fields
+        self.handler = pooled_handler(timeout=timeout, verify=verify)
+        self.headers = [("Authorization", f"Splunk {token}"),
+                        ("Content-Type", "application/json")]
+        if self.channel is not None:
+            self.headers.append(("X-Splunk-Request-Channel", self.channel))
+
+        self.lock = threading.Lock()
+        self.batch = []
+        self.size = 0
+        self.unacked = {}  # ack id: [payload, time sent, attempts]
+        self.error = None
+        self.events = 0
+        self.batches = 0
+        self.bytes = 0
+        self.retries = 0
+
+        self.stopped = threading.Event()
+        self.thread = None
+        if flush_interval:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def send(self, event, time=None, **fields):
+        """Queue an event, a string or a json object, with the given fields
+           on top of the defaults."""
+        self.check()
+        record = dict(self.fields, **fields)
+        if time is not None:
+            record['time'] = time
+        record['event'] = event
+        line = json.dumps(record).encode()
+        with self.lock:
+            self.batch.append(line)
+            self.size += len(line)
+            payload = None
+            if len(self.batch) >= self.batch_count or \
+                    self.size >= self.batch_size:
+                payload = self.take()
+        if payload is not None:
+            self.post(payload)
+
+    def take(self):
+        """The queued events as a payload, with the lock held."""
+        payload = b"\n".join(self.batch)
+        self.events += len(self.batch)
+        self.batch = []
+        self.size = 0
+        return payload
+
+    def flush(self):
+        """Post the queued events."""
+        with self.lock:
+            payload = self.take() if self.batch else None
+        if payload is not None:
+            self.post(payload)
+        self.check()
+
+    def request(self, path, body, headers):
+        response = self.handler(self.url + path, {
+            'method': "POST", 'headers': headers, 'body': body})
+        data = response['body'].read()
+        try:
+            reply = json.loads(data) if data.strip() else {}
+        except ValueError:
+            reply = {'text': data.decode(errors="replace")}
+        return response['status'], reply
+
+    def post(self, payload, attempt=1):
+        """Post a payload, retrying it with a backoff."""
+        body = payload
+        headers = self.headers
+        if self.compress:
+            body = gzip.compress(payload, GZIP_LEVEL)
+            headers = headers + [("Content-Encoding", "gzip")]
+        for tries in range(1, self.attempts + 1):
+            try:
+                status, reply = self.request(EVENT_PATH, body, headers)
+            except (OSError, HTTPException) as e:
+                # a connection closed in the middle of the response raises
+                # an HTTPException, such as BadStatusLine or IncompleteRead
+                error = e
+            else:
+                if status == 200:
+                    with self.lock:
+                        self.batches += 1
+                        self.bytes += len(body)
+                        if self.ack and 'ackId' in reply:
+                            self.unacked[reply['ackId']] = \
+                                [payload, time.monotonic(), attempt]
+                    return
+                error = HECError(status, reply.get('text'))
+                if status not in RETRY_STATUSES:
+                    raise error
+            if tries < self.attempts:
+                with self.lock:
+                    self.retries += 1
+                time.sleep(min(2 ** tries, 30))
+        raise error
+
+    def check_acks(self):
+        """Poll the acknowledgements of the batches sent, and send again the
+           batches not acknowledged in time."""
+        with self.lock:
+            ack_ids = list(self.unacked)
+        if not ack_ids:
+            return
+        status, reply = self.request(ACK_PATH, json.dumps({'acks': ack_ids}),
+                                     self.headers)
+        if status != 200:
+            if status in RETRY_STATUSES:
+                return
+            raise HECError(status, reply.get('text'))
+
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for ack_id, acked in reply.get('acks', {}).items():
+                if acked:
+                    self.unacked.pop(int(ack_id), None)
+            for ack_id, (payload, sent, attempt) in list(self.unacked.items()):
+                if now - sent > self.ack_timeout:
+                    del self.unacked[ack_id]
+                    expired.append((payload, attempt))
+        for payload, attempt in expired:
+            if attempt >= self.attempts:
+                raise HECError(None, f"batch not acknowledged after "
+                                     f"{attempt} attempts")
+            with self.lock:
+                self.retries += 1
+            self.post(payload, attempt + 1)
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                with self.lock:
+                    payload = self.take() if self.batch else None
+                if payload is not None:
+                    self.post(payload)
+                if self.ack:
+                    self.check_acks()
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """Post the queued events and wait for their acknowledgement."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        while self.ack and self.unacked:
+            time.sleep(min(self.flush_interval or 1, 1))
+            self.check_acks()
+        self.check()
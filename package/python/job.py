@@ -20,33 +20,57 @@
 # is either a search-id (sid) or the index of the search job in the list of
 # jobs, eg: @0 would specify the first job in the list, @1 the second, and so
 # on.
+#
+# The job control commands (cancel, finalize, pause, touch, unpause) can also
+# select jobs with filters instead of specifiers. The jobs are listed once and
+# the command is sent to the selected jobs from a pool of threads.
+#
+# The profile command adds up the performance counters of the selected jobs,
+# and optionally the time spent by each component in their search logs.
 
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
+import io
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
 
-from splunklib.client import connect
+from splunklib.binding import HTTPError
 
-from utils import error, parse, cmdline
+from jobrunner import connect
+from utils import error, parse, pump
 
 HELP_EPILOG = """
 Commands:            
-    cancel <search>+
+    cancel <search>* [filters]
     create <query> [options]
     events <search>+
-    finalize <search>+
+    finalize <search>* [filters]
     list [<search>]*
-    pause <search>+
+    pause <search>* [filters]
     preview <search>+
     results <search>+
     searchlog <search>+
     summary <search>+
     perf <search>+
+    profile <search>* [filters] [--searchlog] [--folded=<file>] [--top=<n>]
     timeline <search>+
-    touch <search>+
-    unpause <search>+
+    touch <search>* [filters]
+    unpause <search>* [filters]
+
+Filters:
+    --owner=<user>         Jobs owned by the user
+    --state=<states>       Jobs in one of the comma separated dispatch states
+    --older=<seconds>      Jobs dispatched more than this many seconds ago
+    --min-run=<seconds>    Jobs that ran for at least this many seconds
+    --label=<regex>        Jobs whose label (saved search name) matches
+    --threads=<count>      Number of requests at a time (default is 8)
+    --dry-run              Only list the jobs the command would apply to
 
 A search can be specified either by using it 'search id' ('sid'), or by
 using the index in the listing of searches. For example, @5 would refer
@@ -67,6 +91,13 @@ Examples:
 
     # Get all results for the third search
     job.py results @3
+
+    # Cancel the scheduled searches of nobody still running after 10 minutes
+    job.py cancel --owner=nobody --state=RUNNING --min-run=600 --label=.
+
+    # Profile the scheduled searches, with a flame graph of their commands
+    job.py profile --label=. --searchlog --folded=searches.folded
+    flamegraph.pl searches.folded > searches.svg
 """
 
 FLAGS_CREATE = [
@@ -102,28 +133,227 @@ FLAGS_SUMMARY = [
 ]
 
 
-def cmdline(argv, flags):
+# Number of job control requests sent at a time
+THREADS = 8
+
+# The dispatch time of a job, in its sid: 1311888600.123, rt_1311888600.123,
+# scheduler__nobody__search__RMD5..._at_1311888600_b18031c8d8f4b4e9
+SID_TIME = re.compile(r"(?:^|_)(\d{10})(?:[._]|$)")
+
+RULES_SELECT = {
+    'owner': {
+        'flags': ["--owner"],
+        'help': "Select the jobs owned by this user"
+    },
+    'state': {
+        'flags': ["--state"],
+        'help': "Select the jobs in one of these comma separated dispatch states"
+    },
+    'older': {
+        'flags': ["--older"],
+        'type': "float",
+        'help': "Select the jobs dispatched more than this many seconds ago"
+    },
+    'min_run': {
+        'flags': ["--min-run"],
+        'type': "float",
+        'help': "Select the jobs that ran for at least this many seconds"
+    },
+    'label': {
+        'flags': ["--label"],
+        'help': "Select the jobs whose label matches this regex"
+    },
+    'threads': {
+        'flags': ["--threads"],
+        'default': THREADS,
+        'type': "int",
+        'help': f"Number of requests sent at a time (default is {THREADS})"
+    },
+    'dry_run': {
+        'flags': ["--dry-run"],
+        'default': False,
+        'action': "store_true",
+        'help': "Only list the jobs the command would apply to"
+    }
+}
+
+FILTERS = ["owner", "state", "older", "min_run", "label"]
+
+RULES_PROFILE = dict(RULES_SELECT, **{
+    'searchlog': {
+        'flags': ["--searchlog"],
+        'default': False,
+        'action': "store_true",
+        'help': "Also time the components in the search log of every job"
+    },
+    'folded': {
+        'flags': ["--folded"],
+        'default': "",
+        'help': "Write the command costs as folded stacks for flame graphs"
+    },
+    'top': {
+        'flags': ["--top"],
+        'default': 20,
+        'type': "int",
+        'help': "Number of rows of every report (default is 20)"
+    }
+})
+
+# The counters of a command in the performance of a job
+COUNTERS = ["duration_secs", "invocations", "input_count", "output_count"]
+
+# The timestamp, level and component of a search log line
+SEARCHLOG_LINE = re.compile(
+    r"^(\d\d-\d\d-\d{4} \d\d:\d\d:\d\d\.\d{3})\s+\w+\s+(\S+)")
+
+
+def cmdline(argv, flags, rules=None):
     """A cmdopts wrapper that takes a list of flags and builds the
        corresponding cmdopts rules to match those flags."""
-    rules = {flag: {'flags': [f"--{flag}"]} for flag in flags}
+    rules = dict({flag: {'flags': [f"--{flag}"]} for flag in flags},
+                 **(rules or {}))
     return parse(argv, rules)
 
 
+def dispatch_time(job):
+    """The time the job was dispatched, from its sid, or None."""
+    times = SID_TIME.findall(job.sid)
+    return float(times[-1]) if times else None
+
+
+def read_performance(performance, prefix=""):
+    """Yield the (name, counters) of every command in the performance
+       record of a job, eg. ("command.search.index", {...})."""
+    for key, value in performance.items():
+        if not isinstance(value, dict):
+            continue
+        name = f"{prefix}.{key}" if prefix else key
+        if any(counter in value for counter in COUNTERS):
+            yield name, {counter: float(value.get(counter) or 0)
+                         for counter in COUNTERS}
+        yield from read_performance(value, name)
+
+
+def read_searchlog(stream):
+    """The seconds spent by each component of a search log, the time
+       between a line and the next one going to the component of the
+       line."""
+    phases = defaultdict(float)
+    last = None
+    for line in stream:
+        match = SEARCHLOG_LINE.match(line.decode(errors="replace"))
+        if match is None:
+            continue
+        stamp = datetime.strptime(match.group(1), "%m-%d-%Y %H:%M:%S.%f")
+        if last is not None:
+            phases[last[1]] += (stamp - last[0]).total_seconds()
+        last = (stamp, match.group(2))
+    return phases
+
+
+def folded_stacks(label, commands):
+    """Yield the folded stack lines of the commands of a job, with the self
+       time of each command in milliseconds: a command's duration includes
+       the durations of its subcommands."""
+    for name, counters in commands.items():
+        children = sum(other['duration_secs'] for child, other in commands.items()
+                       if child.rpartition(".")[0] == name)
+        self_time = max(counters['duration_secs'] - children, 0)
+        if self_time >= 0.001:
+            stack = ";".join([label] + name.split("."))
+            yield f"{stack} {round(self_time * 1000)}"
+
+
+def matches(job, filters, now):
+    """Whether the job passes all the given filters."""
+    if filters.get('owner') is not None and \
+            job.access.get('owner') != filters['owner']:
+        return False
+    if filters.get('state') is not None and \
+            job.content.get('dispatchState') not in filters['state'].split(","):
+        return False
+    if filters.get('older') is not None:
+        dispatched = dispatch_time(job)
+        if dispatched is None or now - dispatched < filters['older']:
+            return False
+    if filters.get('min_run') is not None and \
+            float(job.content.get('runDuration') or 0) < filters['min_run']:
+        return False
+    if filters.get('label') is not None and \
+            not re.search(filters['label'], job.content.get('label') or ""):
+        return False
+    return True
+
+
 def output(stream):
     """Write the contents of the given stream to stdout."""
-    while True:
-        content = stream.read(1024)
-        if len(content) == 0:
-            break
-        sys.stdout.write(content)
+    pump(stream)
 
 
 class Program:
     def __init__(self, service):
         self.service = service
+        self._jobs = None
+
+    @property
+    def jobs(self):
+        """The list of jobs, fetched once."""
+        if self._jobs is None:
+            self._jobs = self.service.jobs.list()
+        return self._jobs
 
     def cancel(self, argv):
-        self.foreach(argv, lambda job: job.cancel())
+        self.control(argv, "cancel", lambda job: job.cancel())
+
+    def control(self, argv, command, func):
+        """Apply the function to the jobs given by specifiers or selected by
+           filters, from a pool of threads, and print a summary."""
+        opts = cmdline(argv, [], RULES_SELECT)
+        jobs = self.select(opts)
+
+        if opts.kwargs['dry_run']:
+            for job in jobs:
+                print(f"{command} {job.sid} "
+                      f"[{job.content.get('dispatchState')}] "
+                      f"{job.content.get('label') or ''}")
+            print(f"{len(jobs)} jobs selected")
+            return
+
+        start = time.time()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=opts.kwargs['threads']) as pool:
+            futures = {pool.submit(func, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except HTTPError as e:
+                    failed += 1
+                    error(f"{futures[future].sid}: {e}")
+        elapsed = time.time() - start
+        rate = len(jobs) / elapsed if elapsed else 0
+        print(f"{command}: {len(jobs) - failed} jobs, {failed} failed "
+              f"in {elapsed:.1f}s ({rate:.1f} jobs/s)")
+
+    def select(self, opts, required=True):
+        """The jobs given by specifiers, or the listed jobs, that pass the
+           filters of the options."""
+        if opts.kwargs.get('threads', 1) < 1:
+            error("--threads must be at least 1", 2)
+        filters = {name: opts.kwargs[name] for name in FILTERS
+                   if opts.kwargs.get(name) is not None}
+        if opts.args:
+            jobs = []
+            for item in opts.args:
+                job = self.lookup(item)
+                if job is None:
+                    error(f"Search job '{item}' does not exist", 2)
+                jobs.append(job)
+        elif filters or not required:
+            jobs = self.jobs
+        else:
+            error("Command requires a search specifier or a filter.", 2)
+        now = time.time()
+        return [job for job in jobs if matches(job, filters, now)]
 
     def create(self, argv):
         """Create a search job."""
@@ -142,7 +372,7 @@ class Program:
 
     def finalize(self, argv):
         """Finalize the specified search jobs."""
-        self.foreach(argv, lambda job: job.finalize())
+        self.control(argv, "finalize", lambda job: job.finalize())
 
     def foreach(self, argv, func):
         """Apply the function to each job specified in the argument vector."""
@@ -167,10 +397,8 @@ class Program:
                 print(f"{key}: {job.content[key]}")
 
         if len(argv) == 0:
-            index = 0
-            for job in self.service.jobs:
+            for index, job in enumerate(self.jobs):
                 print(f"@{index} : {job.sid}")
-                index += 1
             return
 
         self.foreach(argv, read)
@@ -190,23 +418,90 @@ class Program:
         """Convert the given search specifier into a search-id (sid)."""
         if spec.startswith('@'):
             index = int(spec[1:])
-            jobs = self.service.jobs.list()
-            if index < len(jobs):
-                return jobs[index].sid
+            if index < len(self.jobs):
+                return self.jobs[index].sid
         return spec  # Assume it was already a valid sid
 
     def lookup(self, spec):
         """Lookup search job by search specifier."""
+        if spec.startswith('@'):
+            index = int(spec[1:])
+            if index < len(self.jobs):
+                return self.jobs[index]
         return self.service.jobs[self.sid(spec)]
 
     def pause(self, argv):
         """Pause the specified search jobs."""
-        self.foreach(argv, lambda job: job.pause())
+        self.control(argv, "pause", lambda job: job.pause())
 
     def perf(self, argv):
         """Retrive performance info for the specified search jobs."""
         self.foreach(argv, lambda job: pprint(job['performance']))
 
+    def profile(self, argv):
+        """Add up the performance counters of the specified jobs, or of all
+           the jobs, by command and by label, and optionally the time spent
+           by the components of their search logs."""
+        opts = cmdline(argv, [], RULES_PROFILE)
+        jobs = self.select(opts, required=False)
+
+        def gather(job):
+            if 'performance' not in job.content:
+                job.refresh()
+            commands = dict(read_performance(job.content.get('performance') or {}))
+            phases = {}
+            if opts.kwargs['searchlog']:
+                phases = read_searchlog(io.BufferedReader(job.searchlog()))
+            return job, commands, phases
+
+        costs = defaultdict(lambda: dict.fromkeys(COUNTERS + ["jobs"], 0))
+        labels = defaultdict(lambda: [0, 0.0])
+        phases = defaultdict(float)
+        folded = []
+        with ThreadPoolExecutor(max_workers=opts.kwargs['threads']) as pool:
+            futures = [pool.submit(gather, job) for job in jobs]
+            for future in as_completed(futures):
+                try:
+                    job, commands, job_phases = future.result()
+                except HTTPError as e:
+                    error(str(e))
+                    continue
+                label = job.content.get('label') or "(adhoc)"
+                labels[label][0] += 1
+                labels[label][1] += float(job.content.get('runDuration') or 0)
+                for name, counters in commands.items():
+                    cost = costs[name]
+                    cost['jobs'] += 1
+                    for counter in COUNTERS:
+                        cost[counter] += counters[counter]
+                for component, seconds in job_phases.items():
+                    phases[component] += seconds
+                folded.extend(folded_stacks(label.replace(";", ":"), commands))
+
+        top = opts.kwargs['top']
+        print(f"{len(jobs)} jobs\n")
+        print(f"{'seconds':>12} {'invocations':>12} {'input':>12} "
+              f"{'output':>12} {'jobs':>6}  command")
+        for name, cost in sorted(costs.items(), key=lambda item:
+                                 -item[1]['duration_secs'])[:top]:
+            print(f"{cost['duration_secs']:12.3f} {cost['invocations']:12.0f} "
+                  f"{cost['input_count']:12.0f} {cost['output_count']:12.0f} "
+                  f"{cost['jobs']:6d}  {name}")
+        print(f"\n{'seconds':>12} {'jobs':>6}  label")
+        for label, (count, seconds) in sorted(labels.items(), key=lambda item:
+                                             -item[1][1])[:top]:
+            print(f"{seconds:12.3f} {count:6d}  {label}")
+        if phases:
+            print(f"\n{'seconds':>12}  search log component")
+            for component, seconds in sorted(phases.items(), key=lambda item:
+                                             -item[1])[:top]:
+                print(f"{seconds:12.3f}  {component}")
+
+        if opts.kwargs['folded']:
+            with open(opts.kwargs['folded'], "w") as fpd:
+                for line in folded:
+                    fpd.write(line + "\n")
+
     def run(self, argv):
         """Dispatch the given command."""
         command = argv[0]
@@ -222,6 +517,7 @@ class Program:
             'searchlog': self.searchlog,
             'summary': self.summary,
             'perf': self.perf,
+            'profile': self.profile,
             'timeline': self.timeline,
             'touch': self.touch,
             'unpause': self.unpause,
@@ -248,10 +544,10 @@ class Program:
         output(job.timeline(**opts.kwargs)))
 
     def touch(self, argv):
-        self.foreach(argv, lambda job: job.touch())
+        self.control(argv, "touch", lambda job: job.touch())
 
     def unpause(self, argv):
-        self.foreach(argv, lambda job: job.unpause())
+        self.control(argv, "unpause", lambda job: job.unpause())
 
 
 def main():
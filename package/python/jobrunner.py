@@ -0,0 +1,374 @@
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Runs search jobs from an asyncio event loop.
+
+The SDK is synchronous, so every request to splunkd is made on a thread of a
+pool shared by all the jobs of a runner, while the event loop waits. A job is
+polled with an exponential backoff, from POLL_MIN up to POLL_MAX seconds
+between two polls, so that hundreds of jobs can be waited on at once without
+a busy loop.
+
+    service = connect(**kwargs_splunk)
+    with JobRunner(service) as runner:
+        async def main():
+            async for query, job, error in runner.as_completed(queries):
+                ...
+        asyncio.run(main())
+
+connect() hands the service a request handler that keeps the connections to
+splunkd open and reuses them between requests and threads.
+
+The results of a finished job can be fetched in pages of PAGE_SIZE results,
+several pages at a time, and written out in order as one csv, xml or json
+result set. Every page is retried on its own.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import asyncio
+import io
+import json
+import ssl
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import client as httplib
+from urllib.parse import urlsplit
+
+import splunklib
+from splunklib import client
+from splunklib.binding import HTTPError, ResponseReader
+
+__all__ = ["JobRunner", "PageJoiner", "PAGED_MODES", "StreamReader",
+           "connect", "fetch_results", "pooled_handler", "run_job",
+           "wait_job"]
+
+# Seconds between two polls of a job, doubling from POLL_MIN up to POLL_MAX
+POLL_MIN = 0.1
+POLL_MAX = 5.0
+
+# Number of requests to splunkd made at the same time by a runner
+CONCURRENCY = 8
+
+# Number of idle connections kept open per server
+POOL_SIZE = 16
+
+# Responses up to this size are read at once so that their connection goes
+# back to the pool, larger ones are streamed on a connection of their own
+POOLED_BODY_SIZE = 1024 * 1024
+
+# Number of results per page, splunkd caps a single request at 50000 results
+# by default (maxresultrows in limits.conf)
+PAGE_SIZE = 50000
+
+# Number of times a page is tried before the fetch fails
+PAGE_ATTEMPTS = 5
+
+PAGED_MODES = ["csv", "xml", "json"]
+
+
+class StreamReader(ResponseReader):
+    """A response reader whose readinto returns the data that has arrived,
+       up to the size asked for, rather than wait for all of it, so that an
+       io.BufferedReader over it yields every line of a stream as soon as
+       the line arrives."""
+
+    def __init__(self, response, connection=None):
+        super().__init__(response, connection)
+        self.response = response
+
+    def readinto(self, byte_array):
+        size = len(byte_array)
+        # what peek() kept comes first
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        if not data:
+            data = self.response.read1(size)
+        byte_array[:len(data)] = data
+        return len(data)
+
+
+def pooled_handler(size=POOL_SIZE, timeout=None, verify=False, context=None):
+    """Returns a request handler that keeps up to size idle keep-alive
+       connections per server and reuses them."""
+    idle = {}
+    lock = threading.Lock()
+
+    def connect(scheme, host, port):
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        if scheme == "http":
+            return httplib.HTTPConnection(host, port, **kwargs)
+        if scheme == "https":
+            if not verify:
+                kwargs['context'] = ssl._create_unverified_context()
+            elif context is not None:
+                kwargs['context'] = context
+            return httplib.HTTPSConnection(host, port, **kwargs)
+        raise ValueError(f"unsupported scheme: {scheme}")
+
+    def checkout(key):
+        with lock:
+            connections = idle.get(key)
+            return connections.pop() if connections else None
+
+    def checkin(key, connection):
+        with lock:
+            connections = idle.setdefault(key, [])
+            if len(connections) < size:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def request(url, message, **kwargs):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        body = message.get("body", "")
+        head = {
+            "Content-Length": str(len(body)),
+            "Host": parts.hostname,
+            "User-Agent": f"splunk-sdk-python/{splunklib.__version__}",
+            "Accept": "*/*",
+            "Connection": "Keep-Alive",
+        }
+        for name, value in message["headers"]:
+            head[name] = value
+        method = message.get("method", "GET")
+
+        connection = checkout(key)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = connect(*key)
+            try:
+                connection.request(method, path, body, head)
+                response = connection.getresponse()
+                break
+            except ConnectionError:
+                connection.close()
+                # the server may have dropped an idle connection, try again
+                # on a new one
+                if not reused:
+                    raise
+                connection = None
+                reused = False
+
+        length = response.getheader("content-length")
+        if not response.will_close and length is not None and \
+                int(length) <= POOLED_BODY_SIZE:
+            reader = StreamReader(io.BytesIO(response.read()))
+            checkin(key, connection)
+        else:
+            reader = StreamReader(response, connection)
+        return {
+            'status': response.status,
+            'reason': response.reason,
+            'headers': response.getheaders(),
+            'body': reader,
+        }
+
+    return request
+
+
+def connect(**kwargs):
+    """Connect to splunkd with a pooled request handler."""
+    handler = pooled_handler(timeout=kwargs.get('timeout'),
+                             verify=kwargs.get('verify', False),
+                             context=kwargs.get('context'))
+    return client.connect(handler=handler, **kwargs)
+
+
+def poll(job):
+    """Refresh the job, returns None while it is not running yet, otherwise
+       whether it is done or failed."""
+    if not job.is_ready():
+        return None
+    return job.content.get("isDone") == "1" or \
+        job.content.get("isFailed") == "1"
+
+
+def read_page(job, offset, count, attempts=PAGE_ATTEMPTS, **kwargs):
+    """Read a page of the results of the job, retrying it with a backoff
+       when the connection or the server fails. A connection dropped in the
+       middle of the page raises an IncompleteRead, an HTTPException."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return job.results(offset=offset, count=count, **kwargs).read()
+        except (HTTPError, httplib.HTTPException, OSError) as e:
+            if attempt == attempts or \
+                    isinstance(e, HTTPError) and e.status < 500:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+
+
+class PageJoiner:
+    """Join the pages of a result set into a single csv, xml or json
+       document: the csv header and the xml and json envelopes are only kept
+       once."""
+
+    def __init__(self, output_mode):
+        if output_mode not in PAGED_MODES:
+            raise ValueError(f"Results in {output_mode} cannot be paged")
+        self.output_mode = output_mode
+        self.first = True
+        self.rows = 0
+
+    def join(self, data, last):
+        """The part of the next page that goes into the result set."""
+        first = self.first
+        self.first = False
+        if self.output_mode == "csv":
+            # every page starts with the header
+            return data if first else data[data.find(b"\n") + 1:]
+        if self.output_mode == "xml":
+            start = 0
+            if not first:
+                start = data.find(b"<result ")
+                if start < 0:
+                    start = data.rfind(b"</results>") if last else len(data)
+            end = len(data)
+            if not last:
+                end = max(data.rfind(b"</results>"), start)
+            return data[start:end]
+
+        doc = json.loads(data) if data.strip() else {}
+        rows = doc.pop("results", [])
+        chunks = []
+        if first:
+            envelope = json.dumps(doc)[:-1]
+            chunks.append(envelope + (", " if doc else "") + '"results": [')
+        for row in rows:
+            chunks.append((", " if self.rows else "") + json.dumps(row))
+            self.rows += 1
+        if last:
+            chunks.append("]}")
+        return "".join(chunks).encode()
+
+
+class JobRunner:
+    """Create and wait on search jobs from an event loop, making the
+       requests on a shared pool of concurrency threads."""
+
+    def __init__(self, service, concurrency=CONCURRENCY, poll_min=POLL_MIN,
+                 poll_max=POLL_MAX):
+        self.service = service
+        self.concurrency = concurrency
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    async def call(self, func, *args, **kwargs):
+        """Make a blocking SDK call on the pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool,
+                                          partial(func, *args, **kwargs))
+
+    async def wait(self, job, progress=None):
+        """Wait for the job to finish, calling progress with the job after
+           every poll once it is running."""
+        delay = self.poll_min
+        while True:
+            finished = await self.call(poll, job)
+            if progress is not None and finished is not None:
+                progress(job)
+            if finished:
+                return job
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max)
+
+    async def run(self, query, progress=None, **kwargs):
+        """Create a job for the query and wait for it to finish."""
+        job = await self.call(self.service.jobs.create, query, **kwargs)
+        return await self.wait(job, progress)
+
+    async def fetch(self, job, fd, page_size=PAGE_SIZE, **kwargs):
+        """Write the results of the finished job to the binary file, reading
+           pages of page_size results concurrently and writing them in
+           order. Returns the number of results."""
+        total = int(job['resultCount'])
+        joiner = PageJoiner(kwargs.get('output_mode', "xml"))
+        offsets = iter(range(0, max(total, 1), page_size))
+        pending = deque()
+
+        def read_ahead():
+            # only hold a few pages more than are being read
+            while len(pending) < 2 * self.concurrency:
+                offset = next(offsets, None)
+                if offset is None:
+                    return
+                pending.append(asyncio.ensure_future(self.call(
+                    read_page, job, offset, page_size, **kwargs)))
+
+        read_ahead()
+        try:
+            while pending:
+                data = await pending.popleft()
+                read_ahead()
+                fd.write(joiner.join(data, last=not pending))
+        finally:
+            for page in pending:
+                page.cancel()
+        fd.flush()
+        return total
+
+    async def as_completed(self, queries, limit=None, **kwargs):
+        """Run a job for every query, at most limit at a time, and yield a
+           (query, job, error) tuple as each of them finishes."""
+        slots = asyncio.Semaphore(limit) if limit else None
+
+        async def run(query):
+            try:
+                if slots is None:
+                    return query, await self.run(query, **kwargs), None
+                async with slots:
+                    return query, await self.run(query, **kwargs), None
+            except Exception as e:
+                return query, None, e
+
+        for finished in asyncio.as_completed([run(query) for query in queries]):
+            yield await finished
+
+
+def run_job(service, query, progress=None, **kwargs):
+    """Run a single job to completion, returns the job."""
+    with JobRunner(service, concurrency=1) as runner:
+        return asyncio.run(runner.run(query, progress, **kwargs))
+
+
+def fetch_results(service, job, fd, page_size=PAGE_SIZE,
+                  concurrency=CONCURRENCY, **kwargs):
+    """Fetch the results of a finished job in pages, see JobRunner.fetch."""
+    with JobRunner(service, concurrency=concurrency) as runner:
+        return asyncio.run(runner.fetch(job, fd, page_size, **kwargs))
+
+
+def wait_job(service, job, progress=None):
+    """Wait for an existing job to finish, returns the job."""
+    with JobRunner(service, concurrency=1) as runner:
+        return asyncio.run(runner.wait(job, progress))
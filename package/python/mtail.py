@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tails many realtime searches from a single process.
+
+The searches are read from a json file that maps a name to every search:
+
+    {"errors": "search index=main log_level=ERROR",
+     "logins": "search sourcetype=auth action=success"}
+
+All the realtime export streams are read on one asyncio event loop, over
+connections that share one session and one SSL context, so tailing 30
+searches costs one process and one login instead of 30. Every stream still
+needs a connection of its own, HTTP/1.1 cannot interleave them.
+
+Results are printed to stdout as json lines tagged with the name of their
+search, or, with --outdir, appended to a `<outdir>/<name>.json` file per
+search. Like stail.py, a stream that drops is reconnected after a jittered
+backoff and replayed from the _time of its newest event."""
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import asyncio
+import json
+import ssl
+from urllib.parse import quote, urlencode
+
+from splunklib.client import connect
+
+import utils
+from stail import Seen, backoff, parse_line
+
+RULES = {
+    'outdir': {
+        'flags': ["--outdir"],
+        'default': "",
+        'help': "Write the results of every search to <outdir>/<name>.json (default is tagged lines on stdout)"
+    }
+}
+
+
+class StreamError(Exception):
+    pass
+
+
+class Response:
+    """ the body of a streamed HTTP response, as json export results """
+
+    def __init__(self, reader, writer, chunked):
+        self.reader = reader
+        self.writer = writer
+        self.chunked = chunked
+
+    async def lines(self):
+        if not self.chunked:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    return
+                yield line
+        pending = b""
+        while True:
+            size = int((await self.reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                break
+            data = pending + await self.reader.readexactly(size)
+            await self.reader.readexactly(2)  # chunk CRLF
+            lines = data.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+
+    async def results(self):
+        """ yield the results of the stream as they arrive """
+
+        try:
+            async for line in self.lines():
+                result = parse_line(line)
+                if result is not None:
+                    yield result
+        finally:
+            self.close()
+
+    def close(self):
+        self.writer.close()
+
+
+class Multiplexer:
+    """ open export streams on the event loop with the session of the
+        service """
+
+    def __init__(self, service):
+        self.service = service
+        self.ssl = None
+        if service.scheme == "https":
+            self.ssl = ssl._create_unverified_context()
+        owner = service.namespace.owner
+        app = service.namespace.app
+        if owner or app:
+            self.path = f"/servicesNS/{quote(owner or '-')}/" \
+                        f"{quote(app or '-')}/search/jobs/export"
+        else:
+            self.path = "/services/search/jobs/export"
+
+    async def export(self, search, **kwargs):
+        """ post an export request, returns the streamed response """
+
+        reader, writer = await asyncio.open_connection(
+            self.service.host, self.service.port, ssl=self.ssl)
+        body = urlencode(dict(search=search, output_mode="json",
+                              time_format="%s.%Q", **kwargs)).encode()
+        # the credentials the sdk sends: a session key, a bearer token,
+        # basic auth or the session cookie
+        headers = [("Host", self.service.host),
+                   *self.service._auth_headers,
+                   ("Content-Type", "application/x-www-form-urlencoded"),
+                   ("Content-Length", str(len(body))),
+                   ("Connection", "close")]
+        head = f"POST {self.path} HTTP/1.1\r\n" + \
+            "".join(f"{name}: {value}\r\n" for name, value in headers) + \
+            "\r\n"
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+        status = (await reader.readline()).split(None, 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in [b"\r\n", b"\n", b""]:
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if len(status) < 2 or status[1] != b"200":
+            writer.close()
+            raise StreamError(f"HTTP {b' '.join(status[1:]).decode().strip()}")
+        chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        return Response(reader, writer, chunked)
+
+
+class Tail:
+    """ a named realtime search and where its results go """
+
+    def __init__(self, name, search, sink):
+        self.name = name
+        self.search = search
+        self.sink = sink
+        self.seen = Seen()
+
+    def emit(self, result):
+        """ write an event unless it was written already """
+
+        if not self.seen.add(result):
+            return
+        if self.sink is sys.stdout:
+            self.sink.write(f"{self.name}\t{json.dumps(result)}\n")
+        else:
+            self.sink.write(json.dumps(result) + "\n")
+
+    async def run(self, mux):
+        attempt = 0
+        while True:
+            try:
+                live = await mux.export(self.search, earliest_time="rt",
+                                        latest_time="rt",
+                                        search_mode="realtime")
+                try:
+                    if self.seen.watermark is not None:
+                        # replay the gap, the export is newest first
+                        backfill = await mux.export(
+                            self.search,
+                            earliest_time=f"{self.seen.watermark:.3f}",
+                            latest_time="now")
+                        results = [result async for result
+                                   in backfill.results()]
+                        for result in reversed(results):
+                            self.emit(result)
+                    async for result in live.results():
+                        self.emit(result)
+                        attempt = 0
+                finally:
+                    # a failed backfill leaves the live stream unread
+                    live.close()
+                error = "stream ended"
+            except (OSError, ValueError, StreamError,
+                    asyncio.IncompleteReadError) as e:
+                error = str(e) or type(e).__name__
+            attempt += 1
+            delay = backoff(attempt)
+            print(f"warning: {self.name}: {error}, reconnecting in "
+                  f"{delay:.1f}s", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+
+async def tail_all(service, tails):
+    mux = Multiplexer(service)
+    await asyncio.gather(*[tail.run(mux) for tail in tails])
+
+
+def main():
+    usage = "usage: %prog [options] <searches.json>"
+    opts = utils.parse(sys.argv[1:], RULES, ".env", usage=usage)
+
+    if len(opts.args) != 1:
+        utils.error("Search config file required", 2)
+    with open(opts.args[0]) as fpd:
+        searches = json.load(fpd)
+
+    outdir = opts.kwargs['outdir']
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    tails = []
+    for name, search in searches.items():
+        sink = sys.stdout
+        if outdir:
+            sink = open(os.path.join(outdir, f"{name}.json"), "a",
+                        buffering=1)
+        tails.append(Tail(name, search, sink))
+
+    service = connect(**opts.kwargs)
+
+    try:
+        asyncio.run(tail_all(service, tails))
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+    finally:
+        for tail in tails:
+            if tail.sink is not sys.stdout:
+                tail.sink.close()
+
+
+if __name__ == "__main__":
+    main()
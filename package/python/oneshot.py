@@ -14,39 +14,130 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""A command line utility for executing oneshot Splunk searches."""
+"""A command line utility for executing oneshot Splunk searches.
+
+   The results are decoded one at a time as the response arrives, rather
+   than once it is read whole. --max-rows is sent to splunkd as the count of
+   results to return, --max-bytes closes the connection once that much of
+   the response is read. With --format=json every result is written as a
+   json line."""
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
+import codecs
+import json
+import re
 from pprint import pprint
 import socket
 
 from splunklib.client import connect
-from splunklib.results import JSONResultsReader
 
 import utils
 
+FORMATS = ["pretty", "json"]
+
+# Bytes read from the response at a time
+BLOCK_SIZE = 64 * 1024
+
+RESULTS_START = re.compile(r'"results"\s*:\s*\[')
+
+RULES = {
+    'max_rows': {
+        'flags': ["--max-rows"],
+        'default': 0,
+        'type': "int",
+        'help': "Return at most this many results (default is the server default)"
+    },
+    'max_bytes': {
+        'flags': ["--max-bytes"],
+        'default': 0,
+        'type': "int",
+        'help': "Stop reading the response after this many bytes (default is no limit)"
+    },
+    'format': {
+        'flags': ["--format"],
+        'default': "pretty",
+        'help': "Output format: pretty or json (default is pretty)"
+    }
+}
+
 
-def pretty(response):
-    reader = JSONResultsReader(response)
-    for result in reader:
-        if isinstance(result, dict):
-            pprint(result)
+def iter_results(response, max_bytes=0):
+    """ yield the results of a json response as they are read, up to
+        max_bytes of it; returns whether the whole response was read """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    wanted = 0  # buffer size at which to try a cut result again
+    read = 0
+    while not max_bytes or read < max_bytes:
+        size = BLOCK_SIZE if not max_bytes else min(BLOCK_SIZE, max_bytes - read)
+        block = response.read(size)
+        read += len(block)
+        buffer += text.decode(block, final=not block)
+        if not started:
+            match = RESULTS_START.search(buffer)
+            if match is None:
+                if not block:
+                    return True
+                continue
+            started = True
+            buffer = buffer[match.end():]
+        if block and len(buffer) < wanted:
+            continue
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return True
+            try:
+                result, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # the result is cut by the end of the block
+                break
+            yield result
+        if not block:
+            return True
+        buffer = buffer[pos:]
+        # a large result is decoded again once it doubled, not every block
+        wanted = 2 * len(buffer)
+    return False
 
 
 def main():
-    usage = "usage: oneshot.py <search>"
-    opts = utils.parse(sys.argv[1:], {}, ".env", usage=usage)
+    usage = "usage: oneshot.py [options] <search>"
+    opts = utils.parse(sys.argv[1:], RULES, ".env", usage=usage)
     if len(opts.args) != 1:
         utils.error("Search expression required", 2)
+    output_format = opts.kwargs.pop('format')
+    if output_format not in FORMATS:
+        utils.error(f"Unknown format: {output_format}", 2)
+    max_rows = opts.kwargs.pop('max_rows')
+    max_bytes = opts.kwargs.pop('max_bytes')
 
     search = opts.args[0]
     service = connect(**opts.kwargs)
     socket.setdefaulttimeout(None)
-    response = service.jobs.oneshot(search, output_mode="json")
+    kwargs = {'count': max_rows} if max_rows else {}
+    response = service.jobs.oneshot(search, output_mode="json", **kwargs)
 
-    pretty(response)
+    results = iter_results(response, max_bytes)
+    try:
+        while True:
+            result = next(results)
+            if output_format == "json":
+                sys.stdout.write(json.dumps(result) + "\n")
+            else:
+                pprint(result)
+    except StopIteration as stop:
+        if not stop.value:
+            print(f"Stopped after {max_bytes} bytes", file=sys.stderr)
+    finally:
+        response.close()
+        sys.stdout.flush()
 
 
 if __name__ == "__main__":
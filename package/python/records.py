@@ -0,0 +1,208 @@
+# Copyright 2011-2015 Splunk, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"): you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Splits the xml, csv and json output of the export endpoint into events.
+
+The splitter is fed the stream block by block and returns an
+(offset, length, _time) tuple for every event completed by the block, where
+offset is the position of the event in the whole stream. Every byte is
+searched once: the search for the end of an event resumes where the previous
+block left off, and csv quote parity is carried over between blocks.
+
+    splitter = RecordSplitter("xml")
+    for block in iter_blocks(stream):
+        for offset, length, event_time in splitter.feed(block):
+            ...
+
+A splitter that starts in the middle of a stream (aligned=False) skips the
+partial event it starts in. A csv stream that does not start with its header
+needs the header passed in.
+
+The key of an event, its (_cd, _time, _bkt) fields, identifies it across
+exports and is used to drop events exported twice.
+"""
+
+import csv
+import re
+
+from utils import iter_blocks
+
+__all__ = ["EVENT_FORMATS", "KEY_FIELDS", "RecordSplitter", "split"]
+
+EVENT_FORMATS = ["csv", "xml", "json"]
+KEY_FIELDS = ["_cd", "_time", "_bkt"]
+
+XML_RECORD_START = b"<result "
+XML_RECORD_END = b"</result>"
+XML_TIME = re.compile(rb"<field k='_time'>\s*<value><text>([^<]*)<")
+JSON_TIME = re.compile(rb'"_time":\s*"([^"]*)"')
+XML_KEY = [re.compile(rb"<field k='%s'>\s*<value><text>([^<]*)<" % name.encode())
+           for name in KEY_FIELDS]
+JSON_KEY = [re.compile(rb'"%s":\s*"([^"]*)"' % name.encode())
+            for name in KEY_FIELDS]
+
+
+class RecordSplitter:
+    """Incrementally split an export stream of the given format into
+       events."""
+
+    def __init__(self, event_format, header=None, aligned=True):
+        if event_format not in EVENT_FORMATS:
+            raise ValueError(f"Unknown event format: {event_format}")
+        self.event_format = event_format
+        self.aligned = aligned
+        self.buffer = bytearray()
+        self.offset = 0  # stream offset of the buffer
+        self.scanned = 0  # end of the part of the buffer searched so far
+        self.quotes = 0  # csv quotes in the current row, up to scanned
+        self.time_column = None
+        self.key_columns = None
+        self.header_end = 0  # stream offset of the end of the csv header
+        if header is not None:
+            self.set_header(header)
+
+    @property
+    def fed(self):
+        """The number of stream bytes fed to the splitter."""
+        return self.offset + len(self.buffer)
+
+    def set_header(self, row):
+        """Use the given csv header row to locate the _time column."""
+        columns = next(csv.reader([bytes(row).decode(errors="replace")]), [])
+        self.time_column = columns.index("_time") if "_time" in columns else -1
+        if all(name in columns for name in KEY_FIELDS):
+            self.key_columns = [columns.index(name) for name in KEY_FIELDS]
+
+    def feed(self, data):
+        """Split the next block of the stream, returns the (offset, length,
+           _time) tuples of the events it completes."""
+        self.buffer += data
+        if self.event_format == "xml":
+            records, consumed = self._split_xml()
+        elif self.event_format == "csv":
+            records, consumed = self._split_csv()
+        else:
+            records, consumed = self._split_json()
+        del self.buffer[:consumed]
+        self.offset += consumed
+        self.scanned = max(self.scanned - consumed, 0)
+        return records
+
+    def key(self, record):
+        """The (_cd, _time, _bkt) key of the given event, or None when the
+           event does not carry them all."""
+        if self.event_format == "csv":
+            if self.key_columns is None:
+                return None
+            try:
+                fields = next(csv.reader([bytes(record).decode(errors="replace")]), [])
+            except csv.Error:
+                return None
+            if len(fields) <= max(self.key_columns):
+                return None
+            return tuple(fields[column] for column in self.key_columns)
+        patterns = XML_KEY if self.event_format == "xml" else JSON_KEY
+        key = []
+        for pattern in patterns:
+            match = pattern.search(record)
+            if match is None:
+                return None
+            key.append(match.group(1).decode())
+        return tuple(key)
+
+    def _split_xml(self):
+        buffer = self.buffer
+        records = []
+        pos = 0
+        while True:
+            start = buffer.find(XML_RECORD_START, pos)
+            if start < 0:
+                # keep what could be the beginning of a start tag
+                return records, max(pos, len(buffer) - len(XML_RECORD_START) + 1)
+            end = buffer.find(XML_RECORD_END, max(start, self.scanned))
+            if end < 0:
+                self.scanned = max(start, len(buffer) - len(XML_RECORD_END) + 1)
+                return records, start
+            end += len(XML_RECORD_END)
+            match = XML_TIME.search(buffer, start, end)
+            event_time = match.group(1).decode() if match else ""
+            records.append((self.offset + start, end - start, event_time))
+            self.scanned = 0
+            pos = end
+
+    def _split_json(self):
+        buffer = self.buffer
+        records = []
+        pos = 0
+        while True:
+            end = buffer.find(b"\n", max(pos, self.scanned))
+            if end < 0:
+                self.scanned = len(buffer)
+                return records, pos
+            end += 1
+            if not self.aligned:
+                self.aligned = True
+            else:
+                match = JSON_TIME.search(buffer, pos, end)
+                if match:
+                    records.append((self.offset + pos, end - pos,
+                                    match.group(1).decode()))
+            pos = end
+
+    def _split_csv(self):
+        # a csv row ends at a newline outside of a quoted field, ie. after an
+        # even number of quotes
+        buffer = self.buffer
+        records = []
+        pos = 0
+        while True:
+            scan = max(pos, self.scanned)
+            end = buffer.find(b"\n", scan)
+            if end < 0:
+                self.quotes += buffer.count(b'"', scan)
+                self.scanned = len(buffer)
+                return records, pos
+            end += 1
+            self.quotes += buffer.count(b'"', scan, end)
+            self.scanned = end
+            if self.quotes % 2:
+                continue
+            self.quotes = 0
+            if not self.aligned:
+                self.aligned = True
+            elif end - pos <= 2 and not buffer[pos:end].strip():
+                pass  # blank line
+            elif self.time_column is None:
+                self.set_header(buffer[pos:end])
+                self.header_end = self.offset + end
+            else:
+                event_time = ""
+                if self.time_column >= 0:
+                    row = buffer[pos:end].decode(errors="replace")
+                    try:
+                        fields = next(csv.reader([row]), [])
+                    except csv.Error:
+                        fields = []
+                    if len(fields) > self.time_column:
+                        event_time = fields[self.time_column]
+                records.append((self.offset + pos, end - pos, event_time))
+            pos = end
+
+
+def split(stream, event_format, block_size=None, **kwargs):
+    """Yield the (offset, length, _time) tuples of the events in the given
+       binary stream."""
+    splitter = RecordSplitter(event_format, **kwargs)
+    for block in iter_blocks(stream, block_size):
+        yield from splitter.feed(block)
@@ -16,21 +16,150 @@
 
 """A script that reads XML search results from stdin and pretty-prints them
    back to stdout. The script is designed to be used with the search.py
-   example, eg: './search.py "search 404" | ./results.py'"""
+   example, eg: './search.py "search 404" | ./results.py'
+
+   The results are parsed incrementally and every result is dropped from
+   the tree once printed, so memory stays flat whatever the size of the
+   stream. Several concatenated result sets, as export streams them, are
+   read one after the other.
+
+   With --format=json every result is written as a json line, with
+   --format=csv as a csv row under a header taken from the field order of
+   the results, or from --fields; multivalue fields are joined with
+   newlines. Messages go to stderr, so the output can be piped on:
+   './search.py "search 404" | ./results.py --format=csv > 404.csv'"""
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
+import csv
+import json
+import re
 from pprint import pprint
+from xml.etree.ElementTree import XMLPullParser
+
+from utils import cmdline, error, iter_blocks
+
+FORMATS = ["pretty", "json", "csv"]
+
+XML_DECLARATION = re.compile(rb"<\?xml[^>]*\?>")
+
+RULES = {
+    'format': {
+        'flags': ["--format"],
+        'default': "pretty",
+        'help': "Output format: pretty, json or csv (default is pretty)"
+    },
+    'fields': {
+        'flags': ["--fields"],
+        'default': "",
+        'help': "Comma separated fields of the csv output (default is the field order of the results)"
+    }
+}
+
+
+def iter_xml(stream):
+    """ yield the blocks of the stream as a single xml document: the result
+        sets are wrapped in a root element and their declarations dropped """
+    yield b"<stream>"
+    pending = b""
+    for block in iter_blocks(stream):
+        data = XML_DECLARATION.sub(b"", pending + bytes(block))
+        # hold back a declaration cut by the end of the block
+        cut = data.rfind(b"<")
+        if cut >= 0 and data.find(b">", cut) < 0 and \
+                b"<?xml".startswith(data[cut:cut + 5]):
+            data, pending = data[:cut], data[cut:]
+        else:
+            pending = b""
+        yield data
+    yield XML_DECLARATION.sub(b"", pending)
+    yield b"</stream>"
+
+
+def field_value(field):
+    values = []
+    for value in field:
+        if value.tag == "v":
+            # _raw, with its segmentation markup
+            values.append("".join(value.itertext()))
+        elif value.tag == "value":
+            text = value.find("text")
+            values.append((text.text or "") if text is not None else "")
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def read_results(stream, on_fields=None):
+    """ yield every result of the xml stream as a dict, calling on_fields
+        with the field order of every result set; messages are printed on
+        stderr """
+    parser = XMLPullParser(events=("start", "end"))
+    root = parent = None
+    for data in iter_xml(stream):
+        parser.feed(data)
+        for event, elem in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = elem
+                elif elem.tag == "results":
+                    parent = elem
+                continue
+            if elem.tag == "result":
+                yield {field.get("k"): field_value(field) for field in elem
+                       if field.tag == "field"}
+                # drop the results read so far from the tree
+                parent.clear()
+            elif elem.tag == "fieldOrder" and on_fields is not None:
+                on_fields([field.text for field in elem])
+            elif elem.tag == "msg":
+                print(f"{elem.get('type')}: {elem.text}", file=sys.stderr)
+            elif elem.tag == "results":
+                root.clear()
+    parser.close()
+
+
+def scalar(value):
+    return "\n".join(value) if isinstance(value, list) else value
+
+
+def main():
+    usage = "usage: %prog [options] [results.xml]"
+    opts = cmdline(sys.argv[1:], RULES, usage=usage)
+    output_format = opts.kwargs['format']
+    if output_format not in FORMATS:
+        error(f"Unknown format: {output_format}", 2)
+
+    stream = sys.stdin.buffer
+    if opts.args:
+        stream = open(opts.args[0], "rb")
 
-from splunklib import results
+    out = sys.stdout
+    if output_format == "pretty":
+        for result in read_results(stream):
+            pprint(result)
+    elif output_format == "json":
+        for result in read_results(stream):
+            out.write(json.dumps(result) + "\n")
+    else:
+        header = {}
+        if opts.kwargs['fields']:
+            header['fields'] = opts.kwargs['fields'].split(",")
 
+        def on_fields(fields):
+            header.setdefault('fields', fields)
 
-def pretty():
-    reader = results.ResultsReader(sys.stdin)
-    for event in reader:
-        pprint(event)
+        writer = None
+        for result in read_results(stream, on_fields):
+            if writer is None:
+                fields = header.get('fields') or list(result)
+                writer = csv.writer(out, lineterminator="\n")
+                writer.writerow(fields)
+            writer.writerow([scalar(result.get(field, ""))
+                             for field in fields])
+    out.flush()
 
 
 if __name__ == "__main__":
-    pretty()
+    main()
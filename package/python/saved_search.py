@@ -219,8 +219,7 @@ def main(argv):
     else:
         result = context.delete(f"saved/searches/{name}", **kwargs)
     print(f"HTTP STATUS: {result.status}")
-    xml_data = result.body.read().decode('utf-8')
-    sys.stdout.write(xml_data)
+    utils.pump(result.body)
 
 
 if __name__ == "__main__":
@@ -14,16 +14,32 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""A command line utility for executing Splunk searches."""
+"""A command line utility for executing Splunk searches.
+
+With --batch, the queries of a file (or stdin with '-'), one per line, are
+run as jobs over a pool of --jobs at a time sharing a single session. The
+results of every query are written to a file of their own in --outdir, named
+after a hash of the query and its arguments, and a summary table of the wall
+time, scanCount and resultCount of every query is printed at the end. A query
+whose results are already in --outdir is not run again unless --refresh is
+given.
+
+The results of a single query are fetched in pages of --page_size results,
+--fetchers pages at a time, unless --offset, --count or a post-processing
+--search is given.
+"""
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
-from time import sleep
+import asyncio
+import hashlib
+import json
+import time
 
 from splunklib.binding import HTTPError
-from splunklib import client
 
+from jobrunner import JobRunner, PAGED_MODES, connect, fetch_results, run_job
 from utils import *
 
 FLAGS_TOOL = ["verbose"]
@@ -41,22 +57,169 @@ FLAGS_RESULTS = [
     "offset", "count", "search", "field_list", "f", "output_mode"
 ]
 
+RULES_BATCH = {
+    'batch': {
+        'flags': ["--batch"],
+        'help': "Run the queries of this file, one per line ('-' for stdin)"
+    },
+    'jobs': {
+        'flags': ["--jobs"],
+        'default': 8,
+        'type': "int",
+        'help': "Number of batch queries run at the same time (default 8)"
+    },
+    'outdir': {
+        'flags': ["--outdir"],
+        'default': "results",
+        'help': "Directory of the batch results (default 'results')"
+    },
+    'refresh': {
+        'flags': ["--refresh"],
+        'default': False,
+        'action': "store_true",
+        'help': "Run the batch queries whose results are already in outdir"
+    },
+}
+
+RULES_FETCH = {
+    'fetchers': {
+        'flags': ["--fetchers"],
+        'default': 4,
+        'type': "int",
+        'help': "Number of result pages fetched at the same time (default 4)"
+    },
+    'page_size': {
+        'flags': ["--page_size"],
+        'default': 50000,
+        'type': "int",
+        'help': "Number of results per page, 0 to fetch them in one go (default 50000)"
+    },
+}
 
-def cmdline(argv, flags, **kwargs):
+
+def cmdline(argv, flags, rules=None, **kwargs):
     """A cmdopts wrapper that takes a list of flags and builds the
        corresponding cmdopts rules to match those flags."""
-    rules = {flag: {'flags': [f"--{flag}"]} for flag in flags}
+    rules = dict({flag: {'flags': [f"--{flag}"]} for flag in flags},
+                 **(rules or {}))
     return parse(argv, rules, ".env", **kwargs)
 
 
+def read_queries(path):
+    """The queries of the batch file, skipping blank lines, comments and
+       repeated queries."""
+    fpd = sys.stdin if path == "-" else open(path)
+    try:
+        lines = [line.strip() for line in fpd]
+    finally:
+        if fpd is not sys.stdin:
+            fpd.close()
+    return list(dict.fromkeys(line for line in lines
+                              if line and not line.startswith("#")))
+
+
+def result_path(outdir, query, kwargs_create, kwargs_results):
+    """The results file of a batch query, named after a hash of the query
+       and its arguments so that it doubles as a cache entry."""
+    key = json.dumps([query, kwargs_create, kwargs_results], sort_keys=True)
+    name = hashlib.sha1(key.encode()).hexdigest()[:16]
+    mode = kwargs_results.get('output_mode', "xml")
+    return os.path.join(outdir, f"{name}.{mode}")
+
+
+def save_results(job, path, kwargs_results):
+    """Write the results of the job to the file, then its stats next to it
+       to mark the file complete."""
+    with open(path + ".tmp", "wb") as fpd:
+        pump(job.results(**kwargs_results), fpd)
+    os.replace(path + ".tmp", path)
+    stats = {'sid': job.sid,
+             'failed': job.content.get('isFailed') == "1",
+             'scanCount': int(job['scanCount']),
+             'resultCount': int(job['resultCount'])}
+    job.cancel()
+    return stats
+
+
+async def run_batch(service, queries, opts, kwargs_create, kwargs_results):
+    """Run the queries, at most --jobs at a time, returns the summary row
+       of each query."""
+    outdir = opts.kwargs['outdir']
+    jobs = max(opts.kwargs['jobs'], 1)
+    slots = asyncio.Semaphore(jobs)
+
+    with JobRunner(service, concurrency=jobs) as runner:
+        async def run(query):
+            path = result_path(outdir, query, kwargs_create, kwargs_results)
+            row = {'query': query, 'path': path}
+            if not opts.kwargs['refresh'] and os.path.exists(path + ".json"):
+                with open(path + ".json") as fpd:
+                    row.update(json.load(fpd), status="cached")
+                return row
+            async with slots:
+                started = time.time()
+                try:
+                    job = await runner.run(query, **kwargs_create)
+                    stats = await runner.call(save_results, job, path,
+                                              kwargs_results)
+                except (HTTPError, OSError) as e:
+                    row.update(status="error", error=str(e),
+                               wall=time.time() - started)
+                    return row
+                stats['wall'] = time.time() - started
+                with open(path + ".json", "w") as fpd:
+                    json.dump(stats, fpd)
+                row.update(stats, status="failed" if stats['failed'] else "done")
+                return row
+
+        return await asyncio.gather(*[run(query) for query in queries])
+
+
+def print_summary(rows):
+    """Print a table of the status, wall time, scanCount and resultCount of
+       the batch queries."""
+    print(f"{'status':8} {'wall':>8} {'scanCount':>12} {'resultCount':>12}  query")
+    for row in rows:
+        wall = f"{row['wall']:.2f}s" if 'wall' in row else "-"
+        print(f"{row['status']:8} {wall:>8} {row.get('scanCount', '-'):>12} "
+              f"{row.get('resultCount', '-'):>12}  {row['query']}")
+        if 'error' in row:
+            print(f"{'':8} {row['error']}")
+        else:
+            print(f"{'':8} -> {row['path']}")
+
+
+def batch(service, opts, kwargs_create, kwargs_results):
+    queries = read_queries(opts.kwargs['batch'])
+    os.makedirs(opts.kwargs['outdir'], exist_ok=True)
+    started = time.time()
+    rows = asyncio.run(run_batch(service, queries, opts, kwargs_create,
+                                 kwargs_results))
+    print_summary(rows)
+    print(f"{len(rows)} queries in {time.time() - started:.2f}s")
+    if any(row['status'] in ["error", "failed"] for row in rows):
+        sys.exit(1)
+
+
 def main(argv):
-    usage = 'usage: %prog [options] "search"'
+    usage = 'usage: %prog [options] "search" | --batch FILE'
 
     flags = []
     flags.extend(FLAGS_TOOL)
     flags.extend(FLAGS_CREATE)
     flags.extend(FLAGS_RESULTS)
-    opts = cmdline(argv, flags, usage=usage)
+    opts = cmdline(argv, flags, dict(RULES_BATCH, **RULES_FETCH), usage=usage)
+
+    kwargs_splunk = dslice(opts.kwargs, FLAGS_SPLUNK)
+    kwargs_create = dslice(opts.kwargs, FLAGS_CREATE)
+    kwargs_results = dslice(opts.kwargs, FLAGS_RESULTS)
+    if 'count' not in kwargs_results:
+        kwargs_results['count'] = 0
+
+    if 'batch' in opts.kwargs:
+        service = connect(**kwargs_splunk)
+        batch(service, opts, kwargs_create, kwargs_results)
+        return
 
     if len(opts.args) != 1:
         error("Search expression required", 2)
@@ -64,11 +227,7 @@ def main(argv):
 
     verbose = opts.kwargs.get("verbose", 0)
 
-    kwargs_splunk = dslice(opts.kwargs, FLAGS_SPLUNK)
-    kwargs_create = dslice(opts.kwargs, FLAGS_CREATE)
-    kwargs_results = dslice(opts.kwargs, FLAGS_RESULTS)
-
-    service = client.connect(**kwargs_splunk)
+    service = connect(**kwargs_splunk)
 
     try:
         service.parse(search, parse_only=True)
@@ -76,38 +235,33 @@ def main(argv):
         error(f"query '{search}' is invalid:\n\t{str(e)}", 2)
         return
 
-    job = service.jobs.create(search, **kwargs_create)
-    while True:
-        while not job.is_ready():
-            pass
-        stats = {'isDone': job['isDone'],
-                 'doneProgress': job['doneProgress'],
-                 'scanCount': job['scanCount'],
-                 'eventCount': job['eventCount'],
-                 'resultCount': job['resultCount']}
-        progress = float(stats['doneProgress']) * 100
-        scanned = int(stats['scanCount'])
-        matched = int(stats['eventCount'])
-        results = int(stats['resultCount'])
-        if verbose > 0:
-            status = (f"\r{progress:03.1f}% | {scanned} scanned | {matched} matched | {results} results")
-            sys.stdout.write(status)
-            sys.stdout.flush()
-        if stats['isDone'] == '1':
-            if verbose > 0:
-                sys.stdout.write('\n')
-            break
-        sleep(2)
+    def report(job):
+        progress = float(job['doneProgress']) * 100
+        scanned = int(job['scanCount'])
+        matched = int(job['eventCount'])
+        results = int(job['resultCount'])
+        status = (f"\r{progress:03.1f}% | {scanned} scanned | {matched} matched | {results} results")
+        sys.stdout.write(status)
+        sys.stdout.flush()
 
-    if 'count' not in kwargs_results:
-        kwargs_results['count'] = 0
-    results = job.results(**kwargs_results)
-    while True:
-        content = results.read(1024)
-        if len(content) == 0:
-            break
-        sys.stdout.write(content.decode('utf-8'))
+    # the job is polled with a backoff until it is done
+    job = run_job(service, search, report if verbose > 0 else None,
+                  **kwargs_create)
+    if verbose > 0:
+        sys.stdout.write('\n')
+
+    paged = opts.kwargs['page_size'] > 0 and \
+        kwargs_results.get('output_mode', "xml") in PAGED_MODES and \
+        not any(flag in opts.kwargs for flag in ["offset", "count", "search"])
+    if paged:
         sys.stdout.flush()
+        del kwargs_results['count']
+        fetch_results(service, job, sys.stdout.buffer,
+                      opts.kwargs['page_size'], opts.kwargs['fetchers'],
+                      **kwargs_results)
+    else:
+        results = job.results(**kwargs_results)
+        pump(results)
     sys.stdout.write('\n')
 
     job.cancel()
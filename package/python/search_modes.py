@@ -2,9 +2,8 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
-import time
 from utils import *
-from splunklib.client import connect
+from jobrunner import connect, run_job
 from splunklib import results
 
 
@@ -21,18 +20,14 @@ def modes(argv):
     service = connect(**kwargs_splunk)
 
     # By default the job will run in 'smart' mode which will omit events for transforming commands
-    job = service.jobs.create('search index=_internal | head 10 | top host')
-    while not job.is_ready():
-        time.sleep(0.5)
+    job = run_job(service, 'search index=_internal | head 10 | top host')
 
     reader = results.JSONResultsReader(job.events(output_mode="json"))
     # Events found: 0
     print(f'Events found with adhoc_search_level="smart": {len(list(reader))}')
 
     # Now set the adhoc_search_level to 'verbose' to see the events
-    job = service.jobs.create('search index=_internal | head 10 | top host', adhoc_search_level='verbose')
-    while not job.is_ready():
-        time.sleep(0.5)
+    job = run_job(service, 'search index=_internal | head 10 | top host', adhoc_search_level='verbose')
 
     reader = results.JSONResultsReader(job.events(output_mode="json"))
     # Events found: 10
@@ -15,44 +15,239 @@
 # under the License.
 
 """Tails a realtime search using the export endpoint and prints results to
-   stdout."""
+   stdout.
+
+   The tail keeps a watermark, the _time of the newest event printed. When
+   the stream drops, it reconnects after a jittered exponential backoff,
+   then replays the events from the watermark on with a historical search
+   before going on with the realtime stream, so that the events of the gap
+   are not lost. The realtime stream is opened before the backfill runs, and
+   the events both return are only printed once: a window of the last
+   SEEN_WINDOW events is kept by _time, host, source, sourcetype and _raw,
+   as realtime events carry no _cd. Event times are printed in seconds since
+   the epoch.
+
+   The lag, the seconds between the _time of an event and its arrival, is
+   reported along with the event rate every --interval seconds on stderr,
+   and appended as json lines to the --metrics file."""
 
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
+import io
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.client import HTTPException
 from pprint import pprint
 
-from splunklib.client import connect
-from splunklib.results import JSONResultsReader
+from splunklib.binding import HTTPError
 
 import utils
+from jobrunner import connect
+
+# Seconds before a reconnect, doubling from BACKOFF_MIN up to BACKOFF_MAX,
+# jittered
+BACKOFF_MIN = 1
+BACKOFF_MAX = 60
+
+# Number of events remembered to drop the ones replayed twice
+SEEN_WINDOW = 10000
+
+RULES = {
+    'interval': {
+        'flags': ["--interval"],
+        'default': 10,
+        'type': "float",
+        'help': "Seconds between two lag reports (default is 10)"
+    },
+    'metrics': {
+        'flags': ["--metrics"],
+        'default': "",
+        'help': "Append lag metrics as json lines to this file"
+    }
+}
+
+
+def backoff(attempt):
+    """ the jittered delay before the given reconnect attempt """
+
+    return random.uniform(0, min(BACKOFF_MIN * 2 ** attempt, BACKOFF_MAX))
+
+
+def parse_line(line):
+    """ the result of a line of a json export stream, or None; the messages
+        of the line are printed on stderr """
+
+    if not line.strip():
+        return None
+    document = json.loads(line)
+    for message in document.get('messages', []):
+        print(f"{message.get('type')}: {message.get('text')}",
+              file=sys.stderr)
+    return document.get('result')
+
+
+def event_time(result):
+    """ the _time of a result in seconds, or None """
+
+    try:
+        return float(result['_time'])
+    except (KeyError, ValueError):
+        return None
+
+
+class Seen:
+    """ the last SEEN_WINDOW events of a stream, to drop the ones replayed
+        twice, and its watermark, the _time of the newest of them """
+
+    def __init__(self, window=SEEN_WINDOW):
+        self.window = window
+        self.keys = OrderedDict()
+        self.watermark = None
+
+    def add(self, result):
+        """ remember an event, returns False if it was seen already """
+
+        key = hash(tuple(str(result.get(field)) for field in
+                         ["_time", "host", "source", "sourcetype", "_raw"]))
+        if key in self.keys:
+            return False
+        self.keys[key] = None
+        if len(self.keys) > self.window:
+            self.keys.popitem(last=False)
+        when = event_time(result)
+        if when is not None:
+            self.watermark = max(self.watermark or when, when)
+        return True
+
+
+def read_results(stream):
+    """ yield the results of a json export stream as they arrive, and print
+        its messages on stderr """
+
+    # line by line, rather than with JSONResultsReader that reads the whole
+    # stream first, through a buffer: iterating over the reader itself reads
+    # a byte at a time. The readinto of the StreamReader of jobrunner.connect
+    # returns what has arrived, so that no line waits for the buffer to fill
+    for line in io.BufferedReader(stream):
+        result = parse_line(line)
+        if result is not None:
+            yield result
+
+
+class Tail:
+    """ a realtime export stream that resumes from its watermark """
+
+    def __init__(self, service, search, interval, metrics):
+        self.service = service
+        self.search = search
+        self.interval = interval
+        self.metrics = metrics
+        self.seen = Seen()
+        self.events = 0
+        self.reconnects = 0
+        self.lag = None
+        self.max_lag = None
+        self.lock = threading.Lock()
+
+    def stream(self, **kwargs):
+        return self.service.get("search/jobs/export",
+                                search=self.search,
+                                output_mode="json",
+                                time_format="%s.%Q",
+                                **kwargs).body
+
+    def emit(self, result):
+        """ print an event unless it was printed already """
+
+        if not self.seen.add(result):
+            return
+        pprint(result)
+
+        arrived = event_time(result)
+        if arrived is None:
+            return
+        with self.lock:
+            self.events += 1
+            self.lag = time.time() - arrived
+            self.max_lag = max(self.max_lag or self.lag, self.lag)
+
+    def connect(self):
+        """ open the realtime stream and replay the events from the
+            watermark on """
+
+        live = self.stream(earliest_time="rt", latest_time="rt",
+                           search_mode="realtime")
+        if self.seen.watermark is not None:
+            # the export is newest first
+            backfill = list(read_results(self.stream(
+                earliest_time=f"{self.seen.watermark:.3f}",
+                latest_time="now")))
+            for result in reversed(backfill):
+                self.emit(result)
+        return live
+
+    def run(self):
+        attempt = 0
+        while True:
+            try:
+                for result in read_results(self.connect()):
+                    self.emit(result)
+                    attempt = 0
+                error = "stream ended"
+            except (HTTPError, HTTPException, OSError, ValueError) as e:
+                # a cut json line is a dropped stream too
+                error = str(e)
+            attempt += 1
+            with self.lock:
+                self.reconnects += 1
+            delay = backoff(attempt)
+            print(f"warning: {error}, reconnecting in {delay:.1f}s",
+                  file=sys.stderr)
+            time.sleep(delay)
+
+    def report(self):
+        """ report the lag and event rate every interval """
+
+        last = (time.time(), 0)
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self.lock:
+                line = {'time': now, 'events': self.events,
+                        'events_per_sec': (self.events - last[1]) / (now - last[0]),
+                        'lag': self.lag, 'max_lag': self.max_lag,
+                        'watermark': self.seen.watermark,
+                        'reconnects': self.reconnects}
+                self.max_lag = None
+            last = (now, line['events'])
+            lag = "-" if line['lag'] is None else f"{line['lag']:.1f}s"
+            print(f"lag {lag} | {line['events_per_sec']:.1f} events/s | "
+                  f"{line['reconnects']} reconnects", file=sys.stderr)
+            if self.metrics:
+                with open(self.metrics, "a") as fpd:
+                    fpd.write(json.dumps(line) + "\n")
 
 
 def main():
     usage = "usage: %prog <search>"
-    opts = utils.parse(sys.argv[1:], {}, ".env", usage=usage)
+    opts = utils.parse(sys.argv[1:], RULES, ".env", usage=usage)
 
     if len(opts.args) != 1:
         utils.error("Search expression required", 2)
     search = opts.args[0]
 
     service = connect(**opts.kwargs)
+    tail = Tail(service, search, opts.kwargs['interval'],
+                opts.kwargs['metrics'])
+    threading.Thread(target=tail.report, daemon=True).start()
 
     try:
-        result = service.get(
-            "search/jobs/export",
-            search=search,
-            earliest_time="rt",
-            latest_time="rt",
-            search_mode="realtime",
-            output_mode="json")
-        print(result.body)
-
-        for result in JSONResultsReader(result.body):
-            if result is not None:
-                print(pprint(result))
-
+        tail.run()
     except KeyboardInterrupt:
         print("\nInterrupted.")
 
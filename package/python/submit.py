@@ -14,16 +14,32 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""A command line utility that submits event data to Splunk from stdin."""
+"""A command line utility that submits event data to Splunk from stdin.
+
+   stdin is read in large blocks and sent as is, newlines included, on the
+   streaming receiver socket, so that splunkd breaks the events. The blocks
+   are coalesced into batches of up to --batch-size bytes, cut after the
+   last newline, and sent from a thread of their own: a batch goes out once
+   it is full or --flush-interval seconds after the previous one. The event
+   and byte rates are reported on stderr."""
 
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
+import threading
+import time
+
 from splunklib import client
 
 from utils import *
 
+# Bytes read from stdin at a time
+READ_SIZE = 1024 * 1024
+
+# Seconds between two progress reports
+REPORT_INTERVAL = 10
+
 RULES = {
     "eventhost": {
         'flags': ["--eventhost"],
@@ -36,10 +52,110 @@ RULES = {
     "sourcetype": {
         'flags': ["--sourcetype"],
         'help': "The event's sourcetype"
+    },
+    "batch_size": {
+        'flags': ["--batch-size"],
+        'default': 4 * 1024 * 1024,
+        'type': "int",
+        'help': "Bytes sent at a time (default is 4MB)"
+    },
+    "flush_interval": {
+        'flags': ["--flush-interval"],
+        'default': 1.0,
+        'type': "float",
+        'help': "Seconds before a partial batch is sent (default is 1)"
     }
 }
 
 
+class Batcher:
+    """Coalesce the blocks written into batches of whole lines, sent on the
+       socket from a thread."""
+
+    def __init__(self, sock, batch_size, flush_interval):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = bytearray()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.error = None
+        self.events = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        with self.cond:
+            # hold the reader back while the network catches up
+            while len(self.pending) >= 2 * self.batch_size and \
+                    self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+            self.pending += data
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            if self.pending and not self.pending.endswith(b"\n"):
+                self.pending += b"\n"
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def take(self):
+        """Wait for a full batch, the flush interval or the end of the input,
+           and take the whole lines pending."""
+        deadline = time.monotonic() + self.flush_interval
+        with self.cond:
+            while not self.closed and len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            end = len(self.pending)
+            if not self.closed:
+                end = self.pending.rfind(b"\n", 0, self.batch_size) + 1
+                if end == 0 and len(self.pending) >= self.batch_size:
+                    # a line longer than a batch
+                    end = self.batch_size
+            batch = bytes(self.pending[:end])
+            del self.pending[:end]
+            self.cond.notify_all()
+            return batch, self.closed and not self.pending
+
+    def run(self):
+        reported = time.time()
+        while True:
+            batch, last = self.take()
+            if batch:
+                try:
+                    self.sock.sendall(batch)
+                except OSError as e:
+                    with self.cond:
+                        self.error = e
+                        self.cond.notify_all()
+                    return
+                self.events += batch.count(b"\n")
+                self.bytes += len(batch)
+            if last:
+                return
+            if time.time() - reported >= REPORT_INTERVAL:
+                reported = time.time()
+                self.report()
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        print(f"{self.events} events, {self.bytes / 2 ** 20:.1f} MB in "
+              f"{elapsed:.1f}s ({self.events / elapsed:.0f} events/s, "
+              f"{self.bytes / 2 ** 20 / elapsed:.1f} MB/s)", file=sys.stderr)
+
+
 def main(argv):
     usage = 'usage: %prog [options] <index>'
     opts = parse(argv, RULES, ".env", usage=usage)
@@ -54,6 +170,8 @@ def main(argv):
     if index not in service.indexes:
         error(f"Index '{index}' does not exist.", 2)
 
+    batch_size = opts.kwargs['batch_size']
+    flush_interval = opts.kwargs['flush_interval']
     kwargs_submit = dslice(opts.kwargs,
                            {'eventhost': 'host'}, 'source', 'sourcetype')
 
@@ -70,12 +188,16 @@ def main(argv):
     #
 
     cn = service.indexes[index].attach(**kwargs_submit)
+    batcher = Batcher(cn, batch_size, flush_interval)
     try:
+        stdin = sys.stdin.buffer
         while True:
-            line = sys.stdin.readline().rstrip('\r\n')
-            if len(line) == 0:
+            block = stdin.read1(READ_SIZE)
+            if not block:
                 break
-            cn.write(line)
+            batcher.write(block)
+        batcher.close()
+        batcher.report()
     finally:
         cn.close()
 
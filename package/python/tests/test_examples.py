@@ -16,6 +16,7 @@
 
 import os
 import sys
+import tempfile
 from subprocess import PIPE, Popen
 
 import testlib
@@ -77,6 +78,9 @@ class ExamplesTestCase(testlib.SDKTestCase):
         run("apicalls_client.py")
         # run("apicalls_httplib.py")
 
+    def test_benchingest(self):
+        self.check_commands("benchingest.py --help")
+
     def test_binding1(self):
         result = run("binding1.py")
         self.assertEqual(result, 0)
@@ -122,7 +126,8 @@ class ExamplesTestCase(testlib.SDKTestCase):
     def test_genevents(self):
         self.check_commands(
             "genevents.py --help",
-            "genevents.py '_internal'")
+            "genevents.py '_internal'",
+            "genevents.py --ingest=submit --workers=2 --count=1000 --rate=0 '_internal'")
 
     def test_get_job(self):
         self.check_commands("get_job.py")
@@ -148,7 +153,9 @@ class ExamplesTestCase(testlib.SDKTestCase):
             "job.py --help",
             "job.py",
             "job.py list",
-            "job.py list @0")
+            "job.py list @0",
+            "job.py cancel --state=DONE --older=86400 --dry-run",
+            "job.py profile @0 --searchlog")
 
     def test_kvstore(self):
         self.check_commands(
@@ -160,8 +167,16 @@ class ExamplesTestCase(testlib.SDKTestCase):
             "loggers.py --help",
             "loggers.py")
 
+    def test_mtail(self):
+        self.check_commands("mtail.py --help")
+
     def test_oneshot(self):
-        self.check_commands(["oneshot.py", "search * | head 10"])
+        self.check_commands(["oneshot.py", "search * | head 10"],
+                            ["oneshot.py", "--format=json", "--max-rows=5",
+                             "--max-bytes=4096", "search * | head 10"])
+
+    def test_results(self):
+        self.check_commands("results.py --help")
 
     def test_saved_search(self):
         temp_name = testlib.tmpname()
@@ -186,6 +201,16 @@ class ExamplesTestCase(testlib.SDKTestCase):
             ["search.py", "search * | head 10"],
             ["search.py", "search * | head 10 | stats count", "--output_mode", "csv"])
 
+    def test_search_batch(self):
+        with tempfile.TemporaryDirectory() as outdir:
+            queries = os.path.join(outdir, "queries.txt")
+            with open(queries, "w") as fpd:
+                fpd.write("search * | head 10\nsearch * | head 10 | stats count\n")
+            self.check_commands(
+                ["search.py", "--batch", queries, "--outdir", outdir, "--output_mode", "csv"])
+            results = [name for name in os.listdir(outdir) if name.endswith(".csv")]
+            self.assertEqual(len(results), 2)
+
     def test_search_modes(self):
         self.check_commands("search_modes.py")
 
@@ -216,6 +241,11 @@ class ExamplesTestCase(testlib.SDKTestCase):
         self.check_commands(
             "upload.py --help",
             f"upload.py --index=sdk-tests {file_to_upload}")
+        with tempfile.TemporaryDirectory() as statedir:
+            state = os.path.join(statedir, "state.db")
+            self.check_commands(
+                ["upload.py", "--index=sdk-tests", "--bulk", "--dry-run",
+                 f"--state={state}", "*.py"])
 
     # The following tests are for the Analytics example
     def test_analytics(self):
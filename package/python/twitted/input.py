@@ -22,10 +22,12 @@ from getpass import getpass
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lib"))
 import requests
 import splunklib.client as client
+from python.hec import HECClient
 from python.utils import error, parse
 
 TWITTER_STREAM_HOST = "https://api.twitter.com"
 TWITTER_STREAM_PATH = "/2/tweets/sample/stream"
+SPLUNK_HEC_URL = "http://localhost:8088"
 
 # Get 100 tweets from Twitter
 MAX_COUNT = 100
@@ -34,11 +36,21 @@ verbose = 1
 TWITTER_BEARER_TOKEN = ""
 SPLUNK_HEC_TOKEN = ""
 count = 0
+hec = None
 
 
 def process_tweets():
-    for event in stream_generator():
-        send_tweets(event)
+    global hec
+    # the tweets are sent in batches, on a connection kept open
+    hec = HECClient(SPLUNK_HEC_URL, SPLUNK_HEC_TOKEN, sourcetype="_json")
+    try:
+        for event in stream_generator():
+            send_tweets(event)
+    finally:
+        try:
+            hec.close()
+        except Exception as e:
+            error(f"Error occurred while sending tweets to HEC: {str(e)}", 2)
 
 
 def stream_generator():
@@ -80,17 +92,7 @@ def stream_generator():
 
 def send_tweets(record):
     try:
-        record_dict = json.loads(record)
-
-        url = "http://localhost:8088/services/collector"
-        event = {"event": record_dict, "sourcetype": "_json"}
-        token = f"Splunk {SPLUNK_HEC_TOKEN}"
-        headers = {"Authorization": token}
-
-        response = requests.post(url, headers=headers, json=event)
-
-        if response.status_code != 200:
-            raise Exception(response.json())
+        hec.send(json.loads(record))
 
     except Exception as e:
         error(f"Error occurred while sending tweets to HEC: {str(e)}", 2)
@@ -14,16 +14,55 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-"""A command line utility that uploads a file to Splunk for indexing."""
+"""A command line utility that uploads a file to Splunk for indexing.
+
+   With --bulk, the arguments may also be directories, walked for the files
+   matching --pattern, and globs (where ** spans directories). The files are
+   uploaded --concurrency at a time, and their status is kept in the --state
+   sqlite database under a fingerprint of their size, mtime and first bytes,
+   so that running again over the same files only uploads the new ones, and
+   the ones that failed. A file is only told apart from the ones already
+   uploaded when it is read here, so bulk uploads are for files that splunkd
+   sees at the same path as this script."""
 import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 
+import fnmatch
+import glob
+import hashlib
+import sqlite3
+import time
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                as_completed, wait)
 from os import path
 
 from splunklib import client
+from splunklib.binding import HTTPError
+from jobrunner import connect
 from utils import *
 
+# Bytes at the head of a file that are hashed into its fingerprint
+HEAD_SIZE = 64 * 1024
+
+CONCURRENCY = 4
+
+# Statuses recorded between two commits of the state database
+COMMIT_INTERVAL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    fingerprint TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_path ON files (path, size, mtime);
+"""
+
 RULES = {
     "eventhost": {
         'flags': ["--eventhost"],
@@ -49,16 +88,179 @@ RULES = {
     "sourcetype": {
         'flags': ["--sourcetype"],
         'help': "The event's sourcetype"
+    },
+    "bulk": {
+        'flags': ["--bulk"],
+        'default': False,
+        'action': "store_true",
+        'help': "Upload directories and globs, skipping the files already uploaded"
+    },
+    "pattern": {
+        'flags': ["--pattern"],
+        'default': "*",
+        'help': "Upload the files of directories matching this glob (default *)"
+    },
+    "state": {
+        'flags': ["--state"],
+        'default': ".upload_state.db",
+        'help': "The database of the files uploaded (default .upload_state.db)"
+    },
+    "concurrency": {
+        'flags': ["--concurrency"],
+        'default': CONCURRENCY,
+        'type': "int",
+        'help': f"Number of uploads at a time (default {CONCURRENCY})"
+    },
+    "force": {
+        'flags': ["--force"],
+        'default': False,
+        'action': "store_true",
+        'help': "Upload the files again even if already uploaded"
+    },
+    "dry_run": {
+        'flags': ["--dry-run"],
+        'default': False,
+        'action': "store_true",
+        'help': "Only list the files that would be uploaded"
     }
 }
 
 
+def find_files(args, pattern):
+    """Yield the absolute paths of the files of the arguments, which are
+       files, directories or globs, once each."""
+    seen = set()
+    for arg in args:
+        if path.isdir(arg):
+            found = (path.join(root, name)
+                     for root, dirs, names in os.walk(arg)
+                     for name in sorted(names) if fnmatch.fnmatch(name, pattern))
+        elif glob.has_magic(arg):
+            found = sorted(glob.iglob(arg, recursive=True))
+        else:
+            found = [arg]
+        for name in found:
+            fullpath = path.abspath(name)
+            if fullpath not in seen and not path.isdir(fullpath):
+                seen.add(fullpath)
+                yield fullpath
+
+
+class State:
+    """The upload status of the files, by fingerprint."""
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        self.pending = 0
+
+    def fingerprint(self, fullpath, stat):
+        """The fingerprint of a file, taken from the database when the file
+           is unchanged since it was recorded, not to read it again."""
+        row = self.db.execute(
+            "SELECT fingerprint FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (fullpath, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+        with open(fullpath, "rb") as fpd:
+            head = hashlib.sha1(fpd.read(HEAD_SIZE)).hexdigest()
+        # a rotated file keeps its size, mtime and head under its new name
+        return f"{stat.st_size}:{stat.st_mtime_ns}:{head}"
+
+    def status(self, fingerprint):
+        row = self.db.execute("SELECT status FROM files WHERE fingerprint = ?",
+                              (fingerprint,)).fetchone()
+        return row[0] if row is not None else None
+
+    def record(self, fingerprint, fullpath, stat, status, message=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (fingerprint, fullpath, stat.st_size, stat.st_mtime_ns, status,
+             message, time.time()))
+        self.pending += 1
+        if self.pending >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def bulk_upload(index, opts, kwargs_submit):
+    """Upload the new files of the arguments concurrently, returns the
+       number of files that failed."""
+    state = State(opts.kwargs['state'])
+    counts = {'uploaded': 0, 'skipped': 0, 'failed': 0}
+
+    def upload(fullpath):
+        index.upload(fullpath, **kwargs_submit)
+
+    def finish(future):
+        fullpath, stat, fingerprint = futures.pop(future)
+        try:
+            future.result()
+        except (HTTPError, OSError) as e:
+            state.record(fingerprint, fullpath, stat, "failed", str(e))
+            print(f"failed {fullpath}: {e}")
+            counts['failed'] += 1
+        else:
+            state.record(fingerprint, fullpath, stat, "uploaded")
+            print(f"uploaded {fullpath}")
+            counts['uploaded'] += 1
+
+    concurrency = max(opts.kwargs['concurrency'], 1)
+    futures = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for fullpath in find_files(opts.args, opts.kwargs['pattern']):
+                try:
+                    stat = os.stat(fullpath)
+                    fingerprint = state.fingerprint(fullpath, stat)
+                except OSError as e:
+                    print(f"failed {fullpath}: {e.strerror}")
+                    counts['failed'] += 1
+                    continue
+                if not opts.kwargs['force'] and \
+                        state.status(fingerprint) == "uploaded":
+                    counts['skipped'] += 1
+                    continue
+                if opts.kwargs['dry_run']:
+                    print(f"upload {fullpath}")
+                    counts['uploaded'] += 1
+                    continue
+                futures[pool.submit(upload, fullpath)] = \
+                    (fullpath, stat, fingerprint)
+                # record the uploads as they end, rather than once all the
+                # files are found
+                if len(futures) >= 2 * concurrency:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+            for future in as_completed(list(futures)):
+                finish(future)
+    finally:
+        state.close()
+
+    verb = "to upload" if opts.kwargs['dry_run'] else "uploaded"
+    print(f"{counts['uploaded']} files {verb}, {counts['skipped']} already "
+          f"uploaded, {counts['failed']} failed")
+    return counts['failed']
+
+
 def main(argv):
     usage = 'usage: %prog [options] <filename>*'
     opts = parse(argv, RULES, ".env", usage=usage)
 
     kwargs_splunk = dslice(opts.kwargs, FLAGS_SPLUNK)
-    service = client.connect(**kwargs_splunk)
+    if opts.kwargs['bulk']:
+        # the uploads share a pool of keep-alive connections
+        service = connect(**kwargs_splunk)
+    else:
+        service = client.connect(**kwargs_splunk)
 
     name = opts.kwargs['index']
     if name not in service.indexes:
@@ -69,6 +271,11 @@ def main(argv):
                            {'eventhost': "host"}, 'source', 'host_regex',
                            'host_segment', 'rename-source', 'sourcetype')
 
+    if opts.kwargs['bulk']:
+        if bulk_upload(index, opts, kwargs_submit):
+            sys.exit(1)
+        return
+
     for arg in opts.args:
         # Note that it's possible the file may not exist (if you had a typo),
         # but it only needs to exist on the Splunk server, which we can't verify.
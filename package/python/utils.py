@@ -21,7 +21,11 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
 from optparse import OptionParser
 from dotenv import dotenv_values
 
-__all__ = ["error", "Parser", "cmdline", "parse", "dslice", "FLAGS_SPLUNK"]
+__all__ = ["error", "Parser", "cmdline", "parse", "dslice", "FLAGS_SPLUNK",
+           "iter_blocks", "pump"]
+
+# Default size of the blocks read by iter_blocks and pump
+BLOCK_SIZE = 1024 * 1024
 
 
 def config(option, opt, value, parser):
@@ -220,6 +224,41 @@ def dslice(value, *args):
     return result
 
 
+def iter_blocks(stream, block_size=None):
+    """Reads the given binary stream in blocks of up to block_size bytes.
+       Every block is a memoryview of the same reusable buffer, so it is only
+       valid until the next block is read; copy it with bytes() to keep it."""
+    buffer = bytearray(block_size or BLOCK_SIZE)
+    view = memoryview(buffer)
+    readinto = getattr(stream, "readinto", None)
+    while True:
+        if readinto is not None:
+            size = readinto(view)
+        else:
+            content = stream.read(len(buffer))
+            size = len(content)
+            view[:size] = content
+        if not size:
+            break
+        yield view[:size]
+
+
+def pump(stream, fd=None, block_size=None):
+    """Copies the given binary stream, eg. a response body, to the given
+       binary file (default stdout) without decoding it. Returns the number
+       of bytes copied."""
+    if fd is None:
+        # Keep the order of anything already printed to stdout
+        sys.stdout.flush()
+        fd = sys.stdout.buffer
+    total = 0
+    for block in iter_blocks(stream, block_size):
+        fd.write(block)
+        total += len(block)
+    fd.flush()
+    return total
+
+
 def parse(argv, rules=None, config=None, **kwargs):
     """Parse the given arg vector with the default Splunk command rules."""
     parser_ = parser(rules, **kwargs)